@@ -0,0 +1,273 @@
+#!/usr/bin/env python
+"""benchmarks for volume loading, slice navigation and drawing
+
+synthetic volumes are written in every supported format to a scratch directory, then load time/peak memory,
+getImageSlice latency per orientation and drawImage throughput (Agg canvas) are measured. Results are printed
+as JSON so that runs can be compared, e.g.
+
+    python pyviz/benchmark.py --shape 64 256 256 -o before.json
+"""
+import sys
+import os
+import time
+import json
+import struct
+import shutil
+import tempfile
+import platform
+import argparse
+import tracemalloc
+
+import numpy as np
+
+FILE_DIR = os.path.abspath(os.path.dirname(__file__))
+sys.path.insert(0, FILE_DIR)
+import helpers as pvh
+import version
+
+ORIENTATIONS = ['axial', 'coronal', 'sagittal']
+
+def syntheticVolume(shape, seed=0):
+    """smooth (z, y, x) float32 phantom with noise, in a CT-like value range"""
+    rng = np.random.default_rng(seed)
+    z, y, x = [np.linspace(-1, 1, n, dtype=np.float32) for n in shape]
+    r2 = z[:, None, None]**2 + y[None, :, None]**2 + x[None, None, :]**2
+    vol = np.where(r2 < 0.8, 1000.0*(1-r2), -1000.0).astype(np.float32)
+    vol += rng.normal(0, 20, size=shape).astype(np.float32)
+    return vol
+
+def _writeRaw(dtype):
+    def write(dirpath, vol):
+        filepath = os.path.join(dirpath, 'volume_{!s}.raw'.format(np.dtype(dtype).char))
+        vol.astype(dtype).tofile(filepath)
+        return filepath, vol.shape[::-1]
+    return write
+
+def _writeBinWithSize(dirpath, vol):
+    filepath = os.path.join(dirpath, 'volume_header.bin')
+    with open(filepath, 'wb') as fd:
+        fd.write(struct.pack('I'*3, *vol.shape[::-1]))
+        fd.write(vol.astype('f').tobytes())
+    return filepath, None
+
+def _writeCTI(dirpath, vol):
+    filepath = os.path.join(dirpath, 'volume.cti')
+    vol.astype('h').tofile(filepath)
+    return filepath, vol.shape[::-1]
+
+def _writeNpy(dirpath, vol):
+    filepath = os.path.join(dirpath, 'volume.npy')
+    np.save(filepath, vol)
+    return filepath, None
+
+def _writeNpz(dirpath, vol):
+    filepath = os.path.join(dirpath, 'volume.npz')
+    np.savez(filepath, volume=vol)
+    return filepath, None
+
+def _writeNpzCompressed(dirpath, vol):
+    filepath = os.path.join(dirpath, 'volume_compressed.npz')
+    np.savez_compressed(filepath, volume=vol)
+    return filepath, None
+
+def _writeH5(dirpath, vol):
+    import h5py
+    filepath = os.path.join(dirpath, 'volume.h5')
+    with h5py.File(filepath, 'w') as f:
+        f.create_dataset('data', data=vol, chunks=True)
+    return filepath, None
+
+def _writeDicom(dirpath, vol):
+    """int16 CT series with rescale intercept, one file per axial slice"""
+    from pydicom.dataset import Dataset, FileMetaDataset
+    from pydicom.uid import ExplicitVRLittleEndian, generate_uid
+    seriesdir = os.path.join(dirpath, 'dicom_series')
+    os.makedirs(seriesdir, exist_ok=True)
+    pixels = np.clip(vol+1024, -32768, 32767).astype(np.int16)
+    uid = generate_uid()
+    for k in range(vol.shape[0]):
+        meta = FileMetaDataset()
+        meta.TransferSyntaxUID = ExplicitVRLittleEndian
+        meta.MediaStorageSOPClassUID = '1.2.840.10008.5.1.4.1.1.2'
+        meta.MediaStorageSOPInstanceUID = generate_uid()
+        ds = Dataset()
+        ds.file_meta = meta
+        ds.SOPClassUID = meta.MediaStorageSOPClassUID
+        ds.SOPInstanceUID = meta.MediaStorageSOPInstanceUID
+        ds.SeriesInstanceUID = uid
+        ds.Modality = 'CT'
+        ds.Rows, ds.Columns = vol.shape[1], vol.shape[2]
+        ds.BitsAllocated, ds.BitsStored, ds.HighBit = 16, 16, 15
+        ds.PixelRepresentation = 1
+        ds.SamplesPerPixel = 1
+        ds.PhotometricInterpretation = 'MONOCHROME2'
+        ds.PixelSpacing = [1.0, 1.0]
+        ds.ImageOrientationPatient = [1, 0, 0, 0, 1, 0]
+        ds.ImagePositionPatient = [0, 0, 2.5*k]
+        ds.InstanceNumber = k
+        ds.RescaleSlope = 1
+        ds.RescaleIntercept = -1024
+        ds.PixelData = pixels[k].tobytes()
+        filepath = os.path.join(seriesdir, 'slice{:04d}.dcm'.format(k))
+        try:
+            ds.save_as(filepath, enforce_file_format=True)
+        except TypeError:
+            # pydicom < 3
+            ds.is_little_endian, ds.is_implicit_VR = True, False
+            ds.save_as(filepath, write_like_original=False)
+    return seriesdir, None
+
+def _writeMatrad(dirpath, vol):
+    from scipy.io import savemat
+    filepath = os.path.join(dirpath, 'volume_matrad.mat')
+    cube = np.empty((1, 1), dtype=object)
+    cube[0, 0] = vol.transpose(1, 2, 0)
+    savemat(filepath, {'ct': {'cube': cube}})
+    return filepath, None
+
+FORMATS = [
+    ('raw_float', _writeRaw('f')),
+    ('raw_double', _writeRaw('d')),
+    ('bin_header', _writeBinWithSize),
+    ('cti_int16', _writeCTI),
+    ('npy', _writeNpy),
+    ('npz', _writeNpz),
+    ('npz_compressed', _writeNpzCompressed),
+    ('hdf5', _writeH5),
+    ('dicom_series', _writeDicom),
+    ('matrad_mat', _writeMatrad),
+]
+
+def _summarize(times):
+    """timing summary in milliseconds"""
+    t = np.asarray(times)*1000
+    return {'n': int(t.size), 'min_ms': float(t.min()), 'median_ms': float(np.median(t)),
+            'mean_ms': float(t.mean()), 'p95_ms': float(np.percentile(t, 95)), 'max_ms': float(t.max())}
+
+def _maxRSS():
+    try:
+        import resource
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return int(rss if sys.platform == 'darwin' else rss*1024)
+    except Exception:
+        return None
+
+def benchmarkLoad(filepath, size, repeats=3):
+    """cold ImageDataProvider.load (fresh provider each time), with peak traced python/numpy allocations"""
+    times, peaks = [], []
+    for ii in range(repeats):
+        provider = pvh.ImageDataProvider(use_dicom_index=False)
+        tracemalloc.start()
+        t0 = time.perf_counter()
+        vol = provider.load(filepath, size)
+        times.append(time.perf_counter()-t0)
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+        if vol is None:
+            raise ValueError('failed to load "{!s}"'.format(filepath))
+        volume_type, dtype, shape = type(vol).__name__, str(vol.dtype), list(vol.shape)
+        provider.resetCache()
+    result = _summarize(times)
+    result.update({'peak_traced_bytes': int(max(peaks)), 'volume_type': volume_type, 'dtype': dtype, 'shape': shape})
+    return result
+
+def benchmarkSlices(filepath, size, nslices=20, seed=0):
+    """getImageSlice latency per orientation; the first access (e.g. a full decode) is reported separately"""
+    provider = pvh.ImageDataProvider(use_dicom_index=False)
+    provider.load(filepath, size)
+    rng = np.random.default_rng(seed)
+    results = {}
+    for orientation, name in enumerate(ORIENTATIONS):
+        count = provider.getSliceCount(filepath, orientation, size=size)
+        indices = rng.integers(0, count, size=nslices+1)
+        times = []
+        for idx in indices:
+            t0 = time.perf_counter()
+            # memmapped slices are views, touch the data as drawing would
+            np.ascontiguousarray(provider.getImageSlice(filepath, int(idx), orientation, size=size))
+            times.append(time.perf_counter()-t0)
+        results[name] = _summarize(times[1:])
+        results[name]['first_ms'] = 1000*times[0]
+    provider.resetCache()
+    return results
+
+def benchmarkDraw(vol, nframes=50, cmap='gray'):
+    """drawImage frames per second on an Agg canvas, with and without blitting, and for the LUT renderer"""
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    import render
+    results = {}
+    for fastredraw in (False, True):
+        figdef = pvh.FigureDefinition_Summary()
+        figdef.canvas_class = FigureCanvasAgg
+        figdef.fastredraw = fastredraw
+        figdef.Build()
+        figdef.figure.set_size_inches(6, 6)
+        figdef.drawImage(figdef.ax_ct, vol[0], cmap=cmap)
+        t0 = time.perf_counter()
+        for ii in range(nframes):
+            figdef.drawImage(figdef.ax_ct, vol[ii % vol.shape[0]], cmap=cmap)
+        elapsed = time.perf_counter()-t0
+        results['agg_blit' if fastredraw else 'agg_full'] = {'fps': nframes/elapsed, 'ms_per_frame': 1000*elapsed/nframes}
+    t0 = time.perf_counter()
+    for ii in range(nframes):
+        render.renderSlice(vol[ii % vol.shape[0]], cmap)
+    elapsed = time.perf_counter()-t0
+    results['lut'] = {'fps': nframes/elapsed, 'ms_per_frame': 1000*elapsed/nframes}
+    return results
+
+def runBenchmarks(shape=(64, 256, 256), formats=None, repeats=3, nslices=20, nframes=50, workdir=None):
+    vol = syntheticVolume(shape)
+    cleanup = workdir is None
+    if workdir is None:
+        workdir = tempfile.mkdtemp(prefix='pyviz_bench_')
+    os.makedirs(workdir, exist_ok=True)
+    results = {'meta': {'pyviz_version': version.get_version(), 'python': platform.python_version(),
+                        'numpy': np.__version__, 'platform': platform.platform(), 'cpu_count': os.cpu_count(),
+                        'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'shape': list(shape), 'repeats': repeats},
+               'formats': {}}
+    try:
+        for name, write in FORMATS:
+            if formats and name not in formats:
+                continue
+            entry = {}
+            try:
+                filepath, size = write(workdir, vol)
+                entry['load'] = benchmarkLoad(filepath, size, repeats=repeats)
+                entry['slice'] = benchmarkSlices(filepath, size, nslices=nslices)
+            except Exception as e:
+                entry['error'] = '{!s}: {!s}'.format(type(e).__name__, e)
+            results['formats'][name] = entry
+        try:
+            results['draw'] = benchmarkDraw(vol, nframes=nframes)
+        except Exception as e:
+            results['draw'] = {'error': '{!s}: {!s}'.format(type(e).__name__, e)}
+        results['meta']['max_rss_bytes'] = _maxRSS()
+    finally:
+        pvh.shutdownDecodePool()
+        if cleanup:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark pyviz loaders, slice access and drawing')
+    parser.add_argument('--shape', type=int, nargs=3, default=(64, 256, 256), metavar=('Z', 'Y', 'X'))
+    parser.add_argument('--formats', nargs='+', choices=[name for name, write in FORMATS])
+    parser.add_argument('--repeats', type=int, default=3, help='cold loads per format')
+    parser.add_argument('--slices', type=int, default=20, help='random slices read per orientation')
+    parser.add_argument('--frames', type=int, default=50, help='slices drawn per draw benchmark')
+    parser.add_argument('--workdir', help='keep generated volumes in this directory (default: temporary)')
+    parser.add_argument('-o', '--output', help='write JSON results to this file instead of stdout')
+    args = parser.parse_args(argv)
+
+    results = runBenchmarks(tuple(args.shape), formats=args.formats, repeats=args.repeats, nslices=args.slices,
+                            nframes=args.frames, workdir=args.workdir)
+    if args.output:
+        with open(args.output, 'w') as fd:
+            json.dump(results, fd, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
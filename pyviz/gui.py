@@ -1,21 +1,22 @@
 #!/usr/bin/env python
+import time
+_T_START = time.perf_counter()
 import sys
 import os
 
 FILE_DIR = os.path.abspath(os.path.dirname(__file__))
 
-from PyQt5.uic import loadUiType
 # from PyQt5.QtCore import pyqtSlot
-from PyQt5 import QtWidgets
+from PyQt5 import QtCore, QtGui, QtWidgets
 from PyQt5.QtWidgets import QMessageBox, QErrorMessage, QFileDialog
 import matplotlib
-import matplotlib.pyplot as plt
 import matplotlib.cm as cm
 matplotlib.use('Qt5Agg')
 
 import os, sys
 from os.path import join
 import pickle
+import threading
 import numpy as np
 
 from matplotlib.backends.backend_qt5agg import (
@@ -35,8 +36,63 @@ try:
 except:
     pass
 
+# report time to first window/image on stderr (enabled with --timing or PYVIZ_STARTUP_TIMING=1). Checked here so
+# that the marks made while importing are reported too
+STARTUP_TIMING = '--timing' in sys.argv or os.environ.get('PYVIZ_STARTUP_TIMING', '') not in ('', '0')
+
+def startupMark(label):
+    if STARTUP_TIMING:
+        print('[startup] {!s}: {:.1f} ms'.format(label, 1000*(time.perf_counter()-_T_START)), file=sys.stderr)
+
+def loadCachedUiType(uifile):
+    """compile a designer layout to python once and reuse it until the .ui file changes
+
+    falls back to compiling at runtime with loadUiType if the cache can't be used
+    """
+    import importlib.util
+    import xml.etree.ElementTree as ET
+    try:
+        widget = ET.parse(uifile).getroot().find('widget')
+        st = os.stat(uifile)
+        cachedir = pvh.getCacheDir()
+        base = os.path.splitext(os.path.basename(uifile))[0]
+        pyfile = join(cachedir, '{!s}_ui_{:x}_{:x}.py'.format(base, st.st_mtime_ns, st.st_size))
+        if not os.path.exists(pyfile):
+            from PyQt5.uic import compileUi
+            os.makedirs(cachedir, exist_ok=True)
+            for f in os.listdir(cachedir):
+                if f.startswith(base+'_ui_') and f.endswith('.py'):
+                    os.remove(join(cachedir, f))
+            tmpfile = '{!s}.{:d}.tmp'.format(pyfile, os.getpid())
+            with open(tmpfile, 'w') as fd:
+                compileUi(uifile, fd)
+            os.replace(tmpfile, pyfile)
+        spec = importlib.util.spec_from_file_location('pyviz_{!s}_ui'.format(base), pyfile)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return getattr(module, 'Ui_'+widget.get('name')), getattr(QtWidgets, widget.get('class'))
+    except Exception as e:
+        print(e)
+        from PyQt5.uic import loadUiType
+        return loadUiType(uifile)
+
+startupMark('imports')
 # compile the gui layout
-Ui_MainWindow, QMainWindow = loadUiType(os.path.join(FILE_DIR, 'window.ui'))
+Ui_MainWindow, QMainWindow = loadCachedUiType(os.path.join(FILE_DIR, 'window.ui'))
+startupMark('ui loaded')
+
+class ScanSignals(QtCore.QObject):
+    """relays batches found by the directory scanner to the gui thread"""
+    batch = QtCore.pyqtSignal(int, list)
+    finished = QtCore.pyqtSignal(int, bool)
+
+class LoadSignals(QtCore.QObject):
+    """relays progress of background loads to the gui thread"""
+    progress = QtCore.pyqtSignal(str, int, int, str)
+    finished = QtCore.pyqtSignal(str)
+    prepared = QtCore.pyqtSignal(str)
+    mask = QtCore.pyqtSignal(str)
+    stats = QtCore.pyqtSignal(str)
 
 # GUI window subclass def
 class Main(QMainWindow, Ui_MainWindow):
@@ -49,18 +105,47 @@ class Main(QMainWindow, Ui_MainWindow):
         # init cache variables
         self.lastValidPath = None
         self.lastValidFile = None
+        self.lastOrientation = 0
 
         # state variables
         self.cmap_manual_sel = False
+        self.firstImageShown = False
+        self.activeLoad = None
+        self.activePrepare = None
+        self.pendingStats = None
+        self.loadSignals = LoadSignals()
+        self.loadSignals.progress.connect(self.__slot_load_progress)
+        self.loadSignals.finished.connect(self.__slot_load_finished)
+        self.loadSignals.prepared.connect(self.__slot_prepared)
+        self.loadSignals.stats.connect(self.__slot_stats_ready)
+        self.loadSignals.mask.connect(self.__slot_mask_loaded)
+        self.scanner = None
+        self.scanParams = None
+        self.scanCancel = None
+        self.scanGeneration = 0
+        self.scanFound = set()
+        self.scanListed = set()
+        self.scanSignals = ScanSignals()
+        self.scanSignals.batch.connect(self.__slot_scan_batch)
+        self.scanSignals.finished.connect(self.__slot_scan_finished)
 
         ########### Setup Signal/slot connections #################
         #  self.chk_recursive.stateChanged.connect(self.__slot_chk_recursive_statechanged__)
         self.chk_autoscale.stateChanged.connect(self.__slot_autoscale_changed)
+        self.combo_autoscale.activated.connect(self.__slot_autoscale_mode_changed)
         self.chk_colorbar.stateChanged.connect(self.__slot_colorbar_changed)
+        self.chk_fastrender.stateChanged.connect(self.__slot_fastrender_changed)
+        self.chk_perf.stateChanged.connect(self.__slot_perf_changed)
         self.combo_cmap.activated.connect(self.__slot_change_cmap__)
         self.combo_orientslice.activated.connect(self.__slot_orient_changed)
-        self.chk_flipx.stateChanged.connect(self.__slot_refreshImage)
-        self.chk_flipy.stateChanged.connect(self.__slot_refreshImage)
+        self.chk_flipx.stateChanged.connect(self.__slot_flip_changed)
+        self.chk_flipy.stateChanged.connect(self.__slot_flip_changed)
+        self.combo_projection.activated.connect(self.__slot_projection_changed)
+        self.chk_oblique.stateChanged.connect(self.__slot_oblique_changed)
+        self.num_tilt_a.valueChanged.connect(self.__slot_oblique_changed)
+        self.num_tilt_b.valueChanged.connect(self.__slot_oblique_changed)
+        self.num_slab.setKeyboardTracking(False)
+        self.num_slab.valueChanged.connect(self.__slot_projection_changed)
         # self.combo_ModeSelect.currentIndexChanged['QString'].connect(self.__slot_changefig_figselect__)
         self.txtPath.editingFinished.connect(self.__slot_txtPath_editingFinished__)
         self.num_Slice.setKeyboardTracking(False)
@@ -69,11 +154,36 @@ class Main(QMainWindow, Ui_MainWindow):
         self.btn_NextSlice.clicked.connect(self.__slot_NextSlice_clicked__)
         self.btn_Open.clicked.connect(self.__openFileDialog__)
         self.listImages.currentTextChanged.connect(self.__slot_listGeneric_currentTextChanged__)
-        #  self.listMasks.currentTextChanged.connect(self.__slot_listMasks_currentTextChanged__)
+        self.listSecondary.itemChanged.connect(self.__slot_listSecondary_itemChanged)
+        self.combo_array.activated.connect(self.__slot_array_changed)
         self.btn_Refresh.clicked.connect(self.__slot_refreshImage)
+        self.slider_frame.valueChanged.connect(self.__slot_frame_changed)
+        self.chk_watch.stateChanged.connect(self.__slot_watch_changed)
         self.btn_ReloadPath.clicked.connect(self.__slot_reloadPath)
         ###########################################################
 
+        # performance readout (load/slice/render timings, fps), enabled with chk_perf
+        self.perfLabel = QtWidgets.QLabel()
+        self.perfLabel.setVisible(False)
+        self.statusBar.addPermanentWidget(self.perfLabel)
+        self.perfTimer = QtCore.QTimer(self)
+        self.perfTimer.setInterval(500)
+        self.perfTimer.timeout.connect(self.__updatePerfLabel__)
+        # toggle a cProfile run, dumped to the cache directory when stopped
+        self.profileShortcut = QtWidgets.QShortcut(QtGui.QKeySequence('Ctrl+Shift+P'), self)
+        self.profileShortcut.activated.connect(self.__slot_toggle_profile)
+
+        # time series (4d) volumes: frame slider, and polling of the displayed file for appended data
+        self.setFrameControlsVisible(False)
+        self.setArrayControlsVisible(False)
+        self.lbl_slab.setEnabled(False)
+        self.num_slab.setEnabled(False)
+        self.num_tilt_a.setEnabled(False)
+        self.num_tilt_b.setEnabled(False)
+        self.watchTimer = QtCore.QTimer(self)
+        self.watchTimer.setInterval(1000)
+        self.watchTimer.timeout.connect(self.__watchFile__)
+
         # get list of cmap names
         #  self.combo_cmap.addItems(list(plt.cm.datad)+list(plt.cm.cmaps_listed))
         self.combo_cmap.addItems(list(cm.cmap_d.keys()))
@@ -83,17 +193,80 @@ class Main(QMainWindow, Ui_MainWindow):
         self.figdef.colorbar_enabled = self.chk_colorbar.isChecked()
         self.figdef.Build()
         self.__updateCanvas__(self.figdef)
+        # views needing a full read of the volume (e.g. coronal dicom) wait for it on a worker thread
+        self.figdef.ctprovider.background_decode = True
+        self.__updateStatsOnLoad__()
+        # checked entries of the secondary list are outlined over the image
+        # structure masks are loaded in the background, the image is redrawn as each one is ready
+        self.maskOverlay = pvh.MaskOverlay(self.figdef.featureprovider, callback=self.loadSignals.mask.emit)
 
     def __slot_autoscale_changed(self, state):
         self.figdef.autoscale = (state==2)
+        self.__updateStatsOnLoad__()
+        self.__updateImage__()
+
+    def __slot_autoscale_mode_changed(self, idx):
+        self.figdef.autoscale_mode = self.combo_autoscale.currentText().lower()
+        self.__updateStatsOnLoad__()
         self.__updateImage__()
 
+    def __updateStatsOnLoad__(self):
+        """have volume statistics computed by the background loads while autoscaling needs them"""
+        self.figdef.ctprovider.stats_on_load = self.chk_autoscale.isChecked() and \
+                self.combo_autoscale.currentText().lower() != 'slice'
+
     def __slot_colorbar_changed(self, state):
         self.figdef.colorbar_enabled = state
         self.figdef.rebuild()
-        self.__slot_refreshImage()
+        self.__updateImage__()
         self.__updateCanvas__(self.figdef)
 
+    def __slot_fastrender_changed(self, state):
+        """switch between matplotlib and the lookup table/QImage display, keeping the loaded volumes"""
+        if state == 2:
+            import lutview
+            figdef = lutview.FigureDefinition_LUT()
+        else:
+            figdef = pvh.FigureDefinition_Summary()
+        figdef.ctprovider = self.figdef.ctprovider
+        figdef.featureprovider = self.figdef.featureprovider
+        figdef.colorbar_enabled = self.chk_colorbar.isChecked()
+        figdef.autoscale = self.chk_autoscale.isChecked()
+        figdef.autoscale_mode = self.combo_autoscale.currentText().lower()
+        figdef.projection, figdef.slab, figdef.tilt = self.figdef.projection, self.figdef.slab, self.figdef.tilt
+        self.figdef.Close()
+        self.figdef = figdef
+        self.figdef.Build()
+        self.__updateCanvas__(self.figdef)
+        self.__updateImage__()
+
+    def __slot_perf_changed(self, state):
+        perf = pvh.getPerfStats()
+        perf.enabled = (state == 2)
+        perf.reset()
+        self.perfLabel.setVisible(perf.enabled)
+        if perf.enabled:
+            self.perfTimer.start()
+            self.__updatePerfLabel__()
+        else:
+            self.perfTimer.stop()
+
+    def __updatePerfLabel__(self):
+        perf = pvh.getPerfStats()
+        def fmt(name):
+            ms = perf.last(name)
+            return '-' if ms is None else '{:.1f}'.format(ms)
+        self.perfLabel.setText('load {!s} ms | slice {!s} ms | render {!s} ms | {:.1f} fps'.format(
+            fmt('load'), fmt('slice'), fmt('render'), perf.fps()))
+
+    def __slot_toggle_profile(self):
+        perf = pvh.getPerfStats()
+        if perf.isProfiling():
+            self.statusBar.showMessage('Profile written to {!s}'.format(perf.stopProfile()))
+        else:
+            perf.startProfile()
+            self.statusBar.showMessage('Profiling... (Ctrl+Shift+P to stop)')
+
     def __slot_orient_changed(self, idx):
         orientation = self.combo_orientslice.currentText()
         if (orientation.lower() == 'coronal (y)'):
@@ -114,7 +287,8 @@ class Main(QMainWindow, Ui_MainWindow):
     def __updateCanvas__(self, figdef):
         self.__clearCanvas__()
         self.mplvl.addWidget(figdef.canvas)
-        self.mplvl.addWidget(NavigationToolbar(figdef.canvas, self.mplWindow, coordinates=True))
+        if figdef.figure is not None:
+            self.mplvl.addWidget(NavigationToolbar(figdef.canvas, self.mplWindow, coordinates=True))
 
     def __clearCanvas__(self):
         for cnt in reversed(range(self.mplvl.count())):
@@ -142,31 +316,232 @@ class Main(QMainWindow, Ui_MainWindow):
     def getSliceNum(self):
         return int(self.num_Slice.value())
 
+    def setFrameControlsVisible(self, visible):
+        self.lbl_frame.setVisible(visible)
+        self.slider_frame.setVisible(visible)
+
+    def setFrameRange(self, nframes, frame):
+        self.slider_frame.blockSignals(True)
+        self.slider_frame.setMaximum(max(0, int(nframes)-1))
+        self.slider_frame.setValue(int(frame))
+        self.slider_frame.blockSignals(False)
+        self.lbl_frame.setText('Frame: {:d}/{:d}'.format(int(frame), max(0, int(nframes)-1)))
+        self.setFrameControlsVisible(nframes > 1)
+
+    def __slot_frame_changed(self, frame):
+        if self.lastValidFile:
+            self.figdef.ctprovider.setFrame(self.lastValidFile, frame)
+        self.__updateImage__()
+
+    def __slot_watch_changed(self, state):
+        if state == 2:
+            self.watchTimer.start()
+        else:
+            self.watchTimer.stop()
+
+    def __watchFile__(self):
+        """pick up data appended to the displayed file, following the newest frame if it was shown"""
+        fullpath = self.lastValidFile
+        provider = self.figdef.ctprovider
+        if not fullpath or self.activeLoad is not None or not provider.refresh(fullpath):
+            return
+        at_end = self.slider_frame.value() >= self.slider_frame.maximum()
+        self.__updateImage__()
+        if at_end and self.slider_frame.maximum() > self.slider_frame.value():
+            self.slider_frame.setValue(self.slider_frame.maximum())
+
+    def __slot_projection_changed(self, *args):
+        mode = {'MIP': 'max', 'MinIP': 'min', 'Mean': 'mean'}.get(self.combo_projection.currentText(), None)
+        self.figdef.projection = mode
+        self.figdef.slab = self.num_slab.value()
+        self.lbl_slab.setEnabled(mode is not None)
+        self.num_slab.setEnabled(mode is not None)
+        self.__updateImage__()
+
+    def __slot_oblique_changed(self, *args):
+        oblique = self.chk_oblique.isChecked()
+        self.num_tilt_a.setEnabled(oblique)
+        self.num_tilt_b.setEnabled(oblique)
+        # oblique planes are numbered at a different spacing, keep the relative position through the volume
+        fullpath = self.lastValidFile
+        before = self.figdef.getImageCount(self.figdef.ctprovider, fullpath, self.lastOrientation) if fullpath else 0
+        self.figdef.tilt = (self.num_tilt_a.value(), self.num_tilt_b.value()) if oblique else None
+        if before > 1:
+            after = self.figdef.getImageCount(self.figdef.ctprovider, fullpath, self.lastOrientation)
+            self.setSliceMax(max(0, after-1))
+            self.setSliceNum(round(self.getSliceNum()*(after-1)/float(before-1)))
+        self.__updateImage__()
+
+    def __slot_flip_changed(self, state):
+        # flipping is applied at draw time, the cached volume is still valid
+        self.__updateImage__()
+
     def __slot_refreshImage(self, *args):
         self.figdef.ctprovider.resetCache()
+        for path in self.maskOverlay.structures():
+            self.maskOverlay.invalidate(path)
         self.__updateImage__()
 
     def __slot_listGeneric_currentTextChanged__(self, currentText):
         if currentText:
             # self.setSliceNum(0)
+            self.__updateArrayList__(self.__itemPath__(self.listImages.currentItem()))
+            self.__updateImage__()
+
+    def setArrayControlsVisible(self, visible):
+        self.lbl_array.setVisible(visible)
+        self.combo_array.setVisible(visible)
+
+    def __updateArrayList__(self, fullpath):
+        """list the arrays of a container file (npz, hdf5, mat) from its headers, for choosing the one shown"""
+        provider = self.figdef.ctprovider
+        arrays = provider.listArrays(fullpath) if os.path.isfile(fullpath) else []
+        self.combo_array.clear()
+        if len(arrays) > 1:
+            self.combo_array.addItem('(default)', None)
+            for name, shape, dtype in arrays:
+                self.combo_array.addItem('{!s} {!s} {!s}'.format(name, 'x'.join(str(x) for x in shape), dtype), name)
+            idx = self.combo_array.findData(provider.getSelectedArray(fullpath))
+            self.combo_array.setCurrentIndex(max(0, idx))
+        self.setArrayControlsVisible(len(arrays) > 1)
+
+    def __slot_array_changed(self, idx):
+        if not self.listImages.currentItem():
+            return
+        fullpath = self.__itemPath__(self.listImages.currentItem())
+        self.figdef.ctprovider.selectArray(fullpath, self.combo_array.itemData(idx))
+        if self.lastValidFile == fullpath:
+            # force the newly selected array to be loaded and shown
+            self.lastValidFile = None
+        self.__updateImage__()
+
+    def __slot_listSecondary_itemChanged(self, item):
+        paths = []
+        for ii in range(self.listSecondary.count()):
+            it = self.listSecondary.item(ii)
+            if it.checkState() == QtCore.Qt.Checked:
+                paths.append(self.__itemPath__(it))
+        self.maskOverlay.setStructures(paths)
+        # show each structure's outline color next to its entry
+        self.listSecondary.blockSignals(True)
+        for ii in range(self.listSecondary.count()):
+            it = self.listSecondary.item(ii)
+            path = self.__itemPath__(it)
+            if path in paths:
+                it.setForeground(QtGui.QBrush(QtGui.QColor(*self.maskOverlay.colorOf(path))))
+            else:
+                it.setForeground(QtGui.QBrush())
+        self.listSecondary.blockSignals(False)
+        self.__updateImage__()
+
+    def __addSecondaryItems__(self, names):
+        for name in names:
+            item = QtWidgets.QListWidgetItem(name)
+            item.setFlags(item.flags() | QtCore.Qt.ItemIsUserCheckable)
+            item.setCheckState(QtCore.Qt.Unchecked)
+            self.listSecondary.addItem(item)
+
+    def __itemPath__(self, item):
+        basepath = str(self.txtPath.text())
+        relpath = item.text().lstrip('./')
+        return os.path.join(basepath, relpath)
+
+    def __prefetchNeighbours__(self, size=None):
+        row = self.listImages.currentRow()
+        paths = []
+        for r in (row+1, row-1):
+            item = self.listImages.item(r)
+            if r >= 0 and item is not None:
+                paths.append(self.__itemPath__(item))
+        self.figdef.ctprovider.prefetch(paths, size=size)
+
+    def __startLoad__(self, fullpath, size=None):
+        """load fullpath in the background, cancelling any other load the user is waiting on"""
+        if self.activeLoad is not None:
+            if self.activeLoad.filepath == fullpath and not self.activeLoad.cancelled:
+                return
+            self.activeLoad.cancel()
+        name = os.path.basename(fullpath.rstrip('/'))
+        self.statusBar.showMessage('Loading {!s}...'.format(name))
+        task = self.figdef.ctprovider.loadAsync(fullpath, size=size,
+                callback=lambda done, total, units: self.loadSignals.progress.emit(fullpath, done, total, units))
+        self.activeLoad = task
+        task.future.add_done_callback(lambda f: self.loadSignals.finished.emit(fullpath))
+
+    def __slot_load_progress(self, fullpath, done, total, units):
+        if any(task is not None and task.filepath == fullpath for task in (self.activeLoad, self.activePrepare)):
+            name = os.path.basename(fullpath.rstrip('/'))
+            self.statusBar.showMessage('Loading {!s}: {:d}/{:d} {!s}'.format(name, done, total, units))
+
+    def __slot_load_finished(self, fullpath):
+        if self.activeLoad is None or self.activeLoad.filepath != fullpath:
+            return # superseded by another selection
+        failed = self.activeLoad.future.result() is None and not self.activeLoad.cancelled
+        self.activeLoad = None
+        self.statusBar.clearMessage()
+        if failed:
+            self.statusBar.showMessage('Failed to load {!s}'.format(os.path.basename(fullpath.rstrip('/'))))
+            self.lastValidFile = None
+            self.figdef.clearAxes()
+            return
+        if self.listImages.currentItem() and self.__itemPath__(self.listImages.currentItem()) == fullpath:
             self.__updateImage__()
 
-    #  def __slot_listMasks_currentTextChanged__(self, currentText):
-    #      if currentText:
-    #          self.__updateImage__()
+    def __waitFullRead__(self, fullpath, size=None):
+        """show progress of the background read the current view waits for, and redraw once it is done"""
+        task = self.figdef.ctprovider.prepareFullRead(fullpath, size=size,
+                callback=lambda done, total, units: self.loadSignals.progress.emit(fullpath, done, total, units))
+        if task is None or task is self.activePrepare:
+            return
+        if self.activePrepare is not None:
+            self.activePrepare.cancel()
+        self.activePrepare = task
+        self.statusBar.showMessage('Loading {!s}...'.format(os.path.basename(fullpath.rstrip('/'))))
+        task.future.add_done_callback(lambda f: self.loadSignals.prepared.emit(fullpath))
+
+    def __slot_mask_loaded(self, path):
+        if path in self.maskOverlay.structures():
+            self.__updateImage__()
+
+    def __slot_stats_ready(self, fullpath):
+        self.pendingStats = None
+        if self.lastValidFile == fullpath:
+            self.__updateImage__()
+
+    def __slot_prepared(self, fullpath):
+        if self.activePrepare is None or self.activePrepare.filepath != fullpath:
+            return # superseded by another selection
+        self.activePrepare = None
+        self.statusBar.clearMessage()
+        if self.lastValidFile == fullpath:
+            self.__updateImage__()
 
     def __updateImage__(self, *args):
+        try: manual_size = (int(self.txt_nx.text()), int(self.txt_ny.text()), int(self.txt_nz.text()))
+        except: manual_size = None
+
         # get CT filepath
         if self.listImages.currentItem():
-            currentText = self.listImages.currentItem().text()
-            basepath = str(self.txtPath.text())
-            relpath = currentText.lstrip('./')
-            fullpath = os.path.join(basepath, relpath)
-            if self.lastValidFile != fullpath:
-                redraw_canvas = True
-            else:
+            fullpath = self.__itemPath__(self.listImages.currentItem())
+            if not self.figdef.ctprovider.isLoaded(fullpath):
+                # keep the current image interactive until the selected volume is ready
+                self.__startLoad__(fullpath, manual_size)
+                fullpath = self.lastValidFile
                 redraw_canvas = False
-            self.lastValidFile = fullpath
+            else:
+                if self.activeLoad is not None:
+                    self.activeLoad.cancel()
+                    self.activeLoad = None
+                    self.statusBar.clearMessage()
+                if self.lastValidFile != fullpath:
+                    redraw_canvas = True
+                    if self.activePrepare is not None and self.activePrepare.filepath != fullpath:
+                        self.activePrepare.cancel()
+                        self.activePrepare = None
+                        self.statusBar.clearMessage()
+                else:
+                    redraw_canvas = False
+                self.lastValidFile = fullpath
         else: fullpath = None
 
         slicenum = self.getSliceNum()
@@ -180,9 +555,6 @@ class Main(QMainWindow, Ui_MainWindow):
             else:
                 cmap = self.combo_cmap.currentText()
 
-            try: manual_size = (int(self.txt_nx.text()), int(self.txt_ny.text()), int(self.txt_nz.text()))
-            except: manual_size = None
-
             orientation = self.combo_orientslice.currentText()
             if (orientation.lower() == 'coronal (y)'):
                 orientation = 1
@@ -194,7 +566,12 @@ class Main(QMainWindow, Ui_MainWindow):
             xaxis_flip = self.chk_flipx.isChecked()
             yaxis_flip = self.chk_flipy.isChecked()
 
-            realslicecount = self.figdef.ctprovider.getSliceCount(fullpath, orientation, manual_size)
+            if redraw_canvas or orientation != self.lastOrientation:
+                # new volume or orientation: make the viewed axis contiguous in the background
+                self.figdef.ctprovider.prepareOrientation(fullpath, orientation, manual_size)
+                self.lastOrientation = orientation
+
+            realslicecount = self.figdef.getImageCount(self.figdef.ctprovider, fullpath, orientation, manual_size)
             if realslicecount <= slicenum:
                 slicenum = realslicecount-1
                 self.setSliceNum(slicenum)
@@ -202,22 +579,52 @@ class Main(QMainWindow, Ui_MainWindow):
             self.setSliceMax(realslicecount-1)
             self.setSliceMin(0)
 
+            nframes = self.figdef.ctprovider.getFrameCount(fullpath, manual_size)
+            self.setFrameRange(nframes, self.figdef.ctprovider.getFrame(fullpath, manual_size))
+
             realsize = self.figdef.ctprovider.getSize()
             aspect_ratio = self.figdef.ctprovider.getAspect(orientation)
+            if self.figdef.tilt is not None:
+                aspect_ratio = 1.0 # resliced to square pixels
             if realsize is None:
                 realsize = ['', '', '']
             self.txt_nx.setText(str(realsize[0]))
             self.txt_ny.setText(str(realsize[1]))
             self.txt_nz.setText(str(realsize[2]))
 
-            ctdata = self.figdef.ctprovider.getImageSlice(fullpath, slicenum, orientation, size=manual_size)
+            ctdata = self.figdef.getImageData(self.figdef.ctprovider, fullpath, slicenum, orientation, size=manual_size)
             if ctdata is not None:
                 if redraw_canvas:
                     #TODO this works but is overkill, we just need to reset the scaling of the current canvas
                     self.figdef.rebuild()
                     self.__updateCanvas__(self.figdef)
-                self.figdef.drawImage(self.figdef.ax_ct, ctdata, cmap=cmap, flipx=xaxis_flip, flipy=yaxis_flip, aspect_ratio=aspect_ratio)
-            else: self.figdef.clearContour(self.figdef.ax_ct)
+                volume_stats = None
+                if self.figdef.autoscale and self.figdef.autoscale_mode != 'slice':
+                    # statistics not computed at load time are computed in the background, slices are scaled
+                    # individually until they are ready
+                    future = self.figdef.ctprovider.prepareStats(fullpath, size=manual_size)
+                    if future is None:
+                        volume_stats = self.figdef.ctprovider.getVolumeStats(fullpath, size=manual_size)
+                    elif future is not self.pendingStats:
+                        self.pendingStats = future
+                        future.add_done_callback(lambda f: self.loadSignals.stats.emit(fullpath))
+                getlevel = overlay = None
+                if self.figdef.projection is None and self.figdef.tilt is None:
+                    getlevel = lambda level: self.figdef.ctprovider.getImageSliceLevel(fullpath, slicenum, orientation, level, size=manual_size)
+                if self.figdef.tilt is None:
+                    # masks are outlined on axis aligned slices only
+                    overlay = self.maskOverlay.getLayer(slicenum, orientation, shape=ctdata.shape, size=manual_size)
+                self.figdef.drawImage(self.figdef.ax_ct, ctdata, cmap=cmap, flipx=xaxis_flip, flipy=yaxis_flip, aspect_ratio=aspect_ratio,
+                                      volume_stats=volume_stats, getlevel=getlevel, overlay=overlay)
+                if not self.firstImageShown:
+                    self.firstImageShown = True
+                    startupMark('first image')
+            else:
+                self.figdef.clearContour(self.figdef.ax_ct)
+                self.__waitFullRead__(fullpath, manual_size)
+
+            if self.chk_prefetch.isChecked() and redraw_canvas:
+                self.__prefetchNeighbours__(size=manual_size)
 
 
     def __slot_txtPath_editingFinished__(self):
@@ -232,24 +639,71 @@ class Main(QMainWindow, Ui_MainWindow):
         self.__slot_txtPath_editingFinished__()
 
     def __loadDirectory__(self, root):
-        """recursively find all BaseVolume objects contained in pickle files under root"""
+        """recursively find all image files under root, filling the list in the background"""
         if (not root == self.lastValidPath):
             if (os.path.exists(root)):
                 self.statusBar.showMessage('Rebuilding Data List, wait...')
                 self.lastValidPath = root
-                img_path_list, mask_path_list, feature_path_list = self.getImageFiles(root, recursive=self.chk_recursive.isChecked())
-                self.listImages.clear()
-                self.listImages.addItems(sorted(img_path_list))
-                #  self.listMasks.clear()
-                #  self.listMasks.addItems(mask_path_list)
-                #  self.listFeatures.clear()
-                #  self.listFeatures.addItems(feature_path_list)
-                self.statusBar.clearMessage()
+                self.__startScan__(root, recursive=self.chk_recursive.isChecked())
                 return True
             else:
                 self.statusBar.showMessage('Invalid Path Supplied, Try again.')
                 return False
 
+    def __getScanner__(self):
+        if self.scanner is None:
+            self.scanner = pvh.DirectoryScanner(self.figdef.ctprovider.getValidExtensions(),
+                                                dicom_index=pvh.getDicomIndex())
+        return self.scanner
+
+    def __startScan__(self, root, recursive=True):
+        """scan root on a worker thread. Rescanning the same root only updates the entries that changed"""
+        if self.scanCancel is not None:
+            self.scanCancel.set()
+        incremental = (self.scanParams == (root, recursive))
+        self.scanParams = (root, recursive)
+        self.scanGeneration += 1
+        self.scanCancel = threading.Event()
+        self.scanFound = set()
+        if not incremental:
+            self.listImages.clear()
+            self.listSecondary.clear()
+        self.scanListed = set(self.listImages.item(ii).text() for ii in range(self.listImages.count()))
+        scanner = self.__getScanner__()
+        def worker(generation, cancel):
+            try:
+                with pvh.getPerfStats().timer('scan', root=root):
+                    for batch in scanner.scan(root, recursive=recursive, cancel=cancel):
+                        self.scanSignals.batch.emit(generation, batch)
+            except Exception as e:
+                print(e)
+            self.scanSignals.finished.emit(generation, cancel.is_set())
+        threading.Thread(target=worker, args=(self.scanGeneration, self.scanCancel), daemon=True).start()
+
+    def __slot_scan_batch(self, generation, batch):
+        if generation != self.scanGeneration:
+            return # results of a cancelled scan
+        new = [x for x in batch if x not in self.scanListed]
+        self.listImages.addItems(new)
+        self.listSecondary.blockSignals(True)
+        self.__addSecondaryItems__(new)
+        self.listSecondary.blockSignals(False)
+        self.scanListed.update(batch)
+        self.scanFound.update(batch)
+        self.statusBar.showMessage('Rebuilding Data List, {:d} found...'.format(len(self.scanFound)))
+
+    def __slot_scan_finished(self, generation, cancelled):
+        if generation != self.scanGeneration:
+            return
+        if not cancelled:
+            # drop entries that no longer exist on disk
+            for listwidget in (self.listImages, self.listSecondary):
+                for ii in reversed(range(listwidget.count())):
+                    if listwidget.item(ii).text() not in self.scanFound:
+                        listwidget.takeItem(ii)
+                listwidget.sortItems()
+        self.scanCancel = None
+        self.statusBar.clearMessage()
 
     def __slot_changefig_sliceNum__(self, sliceNum):
         self.__updateImage__()
@@ -282,40 +736,56 @@ class Main(QMainWindow, Ui_MainWindow):
             self.__slot_txtPath_editingFinished__()
 
     def getImageFiles(self, root, recursive=True, ext=None):
-        ignore_dirs = ['.git']
-        ext = self.figdef.ctprovider.getValidExtensions()
         image_path_list = []
         mask_path_list = []
         feature_path_list = []
-        for head, dirs, files in os.walk(root, followlinks=True):
-            try:
-                if os.path.basename(head) in ignore_dirs:
-                    del dirs[:]; del files[:]; continue
-                for f in files:
-                    if os.path.splitext(f)[1].lower() in ext:
-                        fullfilepath = os.path.join(head, f).replace(root.rstrip('/')+'/', './')
-                        image_path_list.append(fullfilepath)
-                for d in dirs:
-                    for _f in os.listdir(os.path.join(head, d)):
-                        if os.path.splitext(_f)[1] in ['.dcm', '.dicom']:
-                            image_path_list.append(os.path.join(head, d).replace(root.rstrip('/')+'/', './'))
-                            break
-            except Exception as e:
-                print(e)
-            if not recursive:
-                del dirs[:]
+        with pvh.getPerfStats().timer('scan', root=root):
+            for batch in self.__getScanner__().scan(root, recursive=recursive):
+                image_path_list.extend(batch)
         return (image_path_list, mask_path_list, feature_path_list)
 
 
 def start_gui():
+    if '--timing' in sys.argv:
+        sys.argv.remove('--timing')
+    # --perf shows the performance readout, --perf-log PATH also appends every timing to a rotating log
+    perf = '--perf' in sys.argv
+    if perf:
+        sys.argv.remove('--perf')
+    perf_log = os.environ.get('PYVIZ_PERF_LOG', None)
+    if '--perf-log' in sys.argv:
+        idx = sys.argv.index('--perf-log')
+        perf_log = sys.argv[idx+1] if idx+1 < len(sys.argv) else None
+        del sys.argv[idx:idx+2]
+    if perf_log:
+        pvh.getPerfStats().setLogFile(perf_log)
+    # --downcast float32|float16 views float volumes at reduced precision, --reorient-on-disk keeps the
+    # contiguous copies made for coronal/sagittal views of large volumes in temporary files instead of RAM
+    downcast = None
+    if '--downcast' in sys.argv:
+        idx = sys.argv.index('--downcast')
+        downcast = sys.argv[idx+1] if idx+1 < len(sys.argv) else None
+        del sys.argv[idx:idx+2]
+        if downcast not in ('float32', 'float16'):
+            print('--downcast must be one of float32, float16')
+            downcast = None
+    reorient_on_disk = '--reorient-on-disk' in sys.argv
+    if reorient_on_disk:
+        sys.argv.remove('--reorient-on-disk')
     app = QtWidgets.QApplication(sys.argv)
     main = Main()
+    main.figdef.ctprovider.downcast = downcast
+    main.figdef.ctprovider.reorient_on_disk = reorient_on_disk
+    if perf or perf_log:
+        main.chk_perf.setChecked(True)
     if len(sys.argv) > 1 and os.path.exists(sys.argv[1]):
         path = sys.argv[1]
     else:
         path = os.path.expanduser('~')
     main.txtPath.setText(path)
     main.show()
+    # fires once the event loop has painted the window
+    QtCore.QTimer.singleShot(0, lambda: startupMark('first window'))
     return app.exec_()
 
 # Start GUI window
@@ -3,17 +3,22 @@ import os
 from os.path import join, exists
 import re
 import struct
+import json
+import threading
+import time
+import tempfile
+from collections import OrderedDict
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 
 import numpy as np
-from scipy.io import loadmat, savemat, whosmat
-import h5py
 
-import matplotlib as mpl
-import matplotlib.pyplot as plt
-from matplotlib.figure import Figure
-from matplotlib.backends.backend_qt5agg import (
-        FigureCanvasQTAgg as FigureCanvas,
-        NavigationToolbar2QT as NavigationToolbar)
+# scipy, h5py, pydicom and the matplotlib qt backend are imported on first use to keep startup fast
+
+def getCacheDir():
+    """per-user cache directory for pyviz (dicom index, compiled ui)"""
+    cachedir = os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(cachedir, 'pyviz')
 
 def sanitize(string, dirty_chars=['.']):
     for c in dirty_chars:
@@ -29,19 +34,209 @@ def isFileByExt(fname, exts=None):
             return True
     return False
 
+def _decodeDicomFiles(filepaths):
+    """decode raw (stored) pixel data of a list of dicom files into a (nfiles, rows, cols) array (process pool worker)"""
+    import pydicom
+    out = None
+    for ii, f in enumerate(filepaths):
+        pixels = pydicom.dcmread(f).pixel_array
+        if out is None:
+            out = np.empty((len(filepaths),)+pixels.shape, dtype=pixels.dtype)
+        out[ii] = pixels
+    return out
+
+_decode_pool = None
+def getDecodePool():
+    """shared process pool for cpu-bound decoding, created on first use"""
+    global _decode_pool
+    if _decode_pool is None:
+        # spawn rather than fork, since loads run from worker threads of a Qt application
+        _decode_pool = ProcessPoolExecutor(max_workers=max(1, min(8, (os.cpu_count() or 1))),
+                                           mp_context=multiprocessing.get_context('spawn'))
+    return _decode_pool
+
+def shutdownDecodePool():
+    global _decode_pool
+    if _decode_pool is not None:
+        _decode_pool.shutdown(wait=False, cancel_futures=True)
+        _decode_pool = None
+
+
+class PerfStats:
+    """opt-in timing of hot paths (loading, slicing, drawing, scanning)
+
+    timings are kept in short rolling windows per name for the viewer's readout and, with a log file set,
+    appended as JSON lines to a size-limited rotating log. While disabled, timer() costs a single check
+    """
+    def __init__(self, window=100):
+        self.enabled = False
+        self.window = window
+        self._timings = {}
+        self._frames = []
+        self._lock = threading.Lock()
+        self._logger = None
+        self._profile = None
+
+    class _Timer:
+        def __init__(self, stats, name, info):
+            self.stats, self.name, self.info = stats, name, info
+        def __enter__(self):
+            self.t0 = time.perf_counter()
+            return self
+        def __exit__(self, exc_type, exc, tb):
+            if exc_type is not None:
+                self.info['ok'] = False
+            self.stats.record(self.name, time.perf_counter()-self.t0, **self.info)
+            return False
+
+    class _NullTimer:
+        def __enter__(self):
+            return self
+        def __exit__(self, *args):
+            return False
+    _null_timer = _NullTimer()
+
+    def timer(self, name, **info):
+        """context manager recording the duration of its body under name"""
+        if not self.enabled:
+            return self._null_timer
+        return self._Timer(self, name, info)
+
+    def record(self, name, seconds, **info):
+        if not self.enabled:
+            return
+        with self._lock:
+            times = self._timings.setdefault(name, [])
+            times.append(seconds)
+            del times[:-self.window]
+        if self._logger is not None:
+            info.update({'name': name, 'ms': round(1000*seconds, 3), 'time': time.time()})
+            self._logger.info(json.dumps(info, default=str))
+
+    def frame(self):
+        """mark a displayed frame, for the frame rate readout"""
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        with self._lock:
+            self._frames.append(now)
+            # frames within the last 2 seconds
+            while self._frames and now-self._frames[0] > 2.0:
+                self._frames.pop(0)
+
+    def fps(self):
+        with self._lock:
+            if len(self._frames) < 2 or time.perf_counter()-self._frames[-1] > 2.0:
+                return 0.0
+            return (len(self._frames)-1)/max(1e-9, self._frames[-1]-self._frames[0])
+
+    def last(self, name):
+        """most recent duration of name in ms, or None"""
+        with self._lock:
+            times = self._timings.get(name, None)
+            return 1000*times[-1] if times else None
+
+    def summary(self):
+        """{name: {last_ms, mean_ms, max_ms, count}} over the rolling window"""
+        with self._lock:
+            return {name: {'last_ms': 1000*t[-1], 'mean_ms': 1000*sum(t)/len(t), 'max_ms': 1000*max(t), 'count': len(t)}
+                    for name, t in self._timings.items() if t}
+
+    def reset(self):
+        with self._lock:
+            self._timings.clear()
+            self._frames = []
+
+    def setLogFile(self, filepath, max_bytes=10*1024**2, backups=3):
+        """append timings to a rotating JSON-lines log (None to stop logging)"""
+        import logging
+        import logging.handlers
+        logger = logging.getLogger('pyviz.perf')
+        for handler in list(logger.handlers):
+            logger.removeHandler(handler)
+            handler.close()
+        if filepath is None:
+            self._logger = None
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(filepath)), exist_ok=True)
+        handler = logging.handlers.RotatingFileHandler(filepath, maxBytes=max_bytes, backupCount=backups)
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+        self._logger = logger
+
+    def isProfiling(self):
+        return self._profile is not None
+
+    def startProfile(self):
+        import cProfile
+        if self._profile is None:
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+
+    def stopProfile(self, filepath=None):
+        """stop the cProfile run and dump its stats (pstats format) to filepath, returning the path"""
+        if self._profile is None:
+            return None
+        self._profile.disable()
+        if filepath is None:
+            filepath = os.path.join(getCacheDir(), 'profile_{!s}.pstats'.format(time.strftime('%Y%m%d-%H%M%S')))
+        os.makedirs(os.path.dirname(os.path.abspath(filepath)), exist_ok=True)
+        self._profile.dump_stats(filepath)
+        self._profile = None
+        return filepath
+
+_perf_stats = None
+def getPerfStats():
+    """instrumentation shared by providers, figure definitions and the gui"""
+    global _perf_stats
+    if _perf_stats is None:
+        _perf_stats = PerfStats()
+    return _perf_stats
+
 
 from abc import ABCMeta, abstractmethod
 class baseFigureDefinition:
     __metaclass__ = ABCMeta
+    # matplotlib canvas class created by Build(); None selects the Qt5Agg canvas used by the viewer
+    canvas_class = None
+
     def __init__(self):
         self.figure = None
         self.canvas = None
         self.contours = None
         self._initialized = None
+        # 'max', 'min' or 'mean' to show projections instead of slices; over the whole volume if slab is 0,
+        # otherwise over a slab of that many slices centred on the current slice
+        self.projection = None
+        self.slab = 0
+        # (a, b) degrees to show oblique planes tilted from the orientation's slices (see ObliqueReslicer)
+        self.tilt = None
+
+    def getImageData(self, provider, filepath, slicenum, orientation=0, size=None):
+        """slice (or oblique plane, projection/thick slab) of filepath to draw, according to tilt, projection and slab"""
+        if self.tilt is not None:
+            return provider.getObliqueSlice(filepath, slicenum, orientation, self.tilt, size=size)
+        if self.projection is None:
+            return provider.getImageSlice(filepath, slicenum, orientation, size=size)
+        start = stop = None
+        if self.slab > 0:
+            start = max(0, slicenum-self.slab//2)
+            stop = start+self.slab
+        return provider.getProjection(filepath, self.projection, orientation, start, stop, size=size)
+
+    def getImageCount(self, provider, filepath, orientation=0, size=None):
+        """number of slices (or oblique planes) that getImageData can show"""
+        if self.tilt is not None:
+            return provider.getObliqueSliceCount(filepath, orientation, self.tilt, size=size)
+        return provider.getSliceCount(filepath, orientation, size=size)
 
     # must be redefined by subclass
     @abstractmethod
     def Build(self, fig):
+        FigureCanvas = self.canvas_class
+        if FigureCanvas is None:
+            from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
         self.figure = fig
         self.canvas = FigureCanvas(self.figure)
         self.canvas.draw()
@@ -56,6 +251,18 @@ class FigureDefinition_Summary(baseFigureDefinition):
         self._autoscale = True
         self.trueaspect = True
         self.clim = None
+        self.ctprovider = None
+        self.featureprovider = None
+        self.fastredraw = True  # blit slice updates over a cached background
+        self.autoscale_mode = 'slice'  # one of 'slice', 'volume', 'percentile'
+        self.percentile_clip = (1, 99)
+        self.multires = True  # draw a downsampled pyramid level / cropped region matched to the canvas
+        self._source = None
+        self._view = None
+        self._datashape = None
+        self.colorbar = None
+        self._colorbar_clim = None
+        self._background = None
 
     @property
     def autoscale(self):
@@ -66,6 +273,7 @@ class FigureDefinition_Summary(baseFigureDefinition):
         self._autoscale = bool(v)
 
     def Build(self):
+        from matplotlib.figure import Figure
         fig = Figure()
         if self.colorbar_enabled:
             self.ax_ct = fig.add_axes([0.0,0.025,0.85,0.95])
@@ -77,13 +285,26 @@ class FigureDefinition_Summary(baseFigureDefinition):
         #  for ax in fig.get_axes():
         #      ax.set_axis_off()
 
-        if not self._initialized:
-            # setup imagedataproviders
+        if self.ctprovider is None:
+            # setup imagedataproviders (kept when switching from another figure definition)
             self.ctprovider = ImageDataProvider()
             self.featureprovider = ImageDataProvider()
 
+        self.colorbar = None
+        self.contours = None
+        self._background = None
+        self._source = None
+        self._view = None
+        self._datashape = None
+
         # must call last and pass figure instance
         super().Build(fig)
+        self.canvas.mpl_connect('draw_event', self._onDraw)
+        self.ax_ct.callbacks.connect('xlim_changed', self._onLimitsChanged)
+        self.ax_ct.callbacks.connect('ylim_changed', self._onLimitsChanged)
+        self._view_timer = self.canvas.new_timer(interval=50)
+        self._view_timer.single_shot = True
+        self._view_timer.add_callback(self._refreshView)
 
     def rebuild(self):
         if not self.autoscale and len(self.ax_ct.get_images())>0:
@@ -97,13 +318,42 @@ class FigureDefinition_Summary(baseFigureDefinition):
         self.clearAxes()
         self.ax_ct = None
         self.ax_colorbar = None
+        self.colorbar = None
         self.figure.clear()
-        plt.close(self.figure)
 
 
     def redrawCanvas(self):
         self.canvas.draw()
 
+    def _animatedArtists(self):
+        """artists that change with every slice and are excluded from the cached background"""
+        if self.ax_ct is None:
+            return []
+        # the contour layer is one of the axes images
+        return list(self.ax_ct.get_images())
+
+    def _onDraw(self, event):
+        # a full draw (resize, zoom/pan, new artists) renders only the static parts of the figure.
+        # cache them as the background for blitting, then draw the per-slice artists on top
+        if not self.fastredraw:
+            return
+        if event.canvas is not self.canvas or self.canvas.is_saving():
+            # exporting (savefig): animated artists are left out of the figure draw, render them into the file
+            # but keep the background of the screen canvas
+            for artist in self._animatedArtists():
+                artist.draw(event.renderer)
+            return
+        self._background = self.canvas.copy_from_bbox(self.figure.bbox)
+        for artist in self._animatedArtists():
+            self.figure.draw_artist(artist)
+
+    def _blit(self):
+        """redraw only the per-slice artists over the cached background"""
+        self.canvas.restore_region(self._background)
+        for artist in self._animatedArtists():
+            self.figure.draw_artist(artist)
+        self.canvas.blit(self.ax_ct.bbox)
+
     def clearAxes(self, ax=None):
         if not ax:
             ax_list = [x for x in self.figure.get_axes()]
@@ -112,19 +362,100 @@ class FigureDefinition_Summary(baseFigureDefinition):
         for ax in ax_list:
             for item in ax.get_images():
                 item.remove()
-            self.clearContour(ax)
-        self.canvas.draw()
+        # the contour layer was removed with the images
+        self.contours = None
+        self._background = None
+        self.canvas.draw_idle()
+
+    def volumeClim(self, stats):
+        """color limits for the current autoscale mode from volume-wide stats, or None to scale to each slice"""
+        return statsClim(stats, self.autoscale_mode, self.percentile_clip)
+
+    def _selectView(self, ax, shape, getlevel=None):
+        """pyramid level and visible region (r0, r1, c0, c1 in full resolution pixels) for the current zoom"""
+        h, w = shape[:2]
+        x0, x1 = sorted(ax.get_xlim())
+        y0, y1 = sorted(ax.get_ylim())
+        c0, c1 = max(0, int(np.floor(x0+0.5))), min(w, int(np.ceil(x1+0.5)))
+        r0, r1 = max(0, int(np.floor(y0+0.5))), min(h, int(np.ceil(y1+0.5)))
+        if c1 <= c0 or r1 <= r0:
+            r0, r1, c0, c1 = 0, h, 0, w
+        level = 0
+        if getlevel is not None:
+            # data pixels per screen pixel of the visible region
+            ratio = min((c1-c0)/max(1.0, ax.bbox.width), (r1-r0)/max(1.0, ax.bbox.height))
+            while 2**(level+1) <= ratio and min(h, w) >> (level+1) >= 1:
+                level += 1
+        return (level, r0, r1, c0, c1)
+
+    def _viewData(self, view):
+        """array and extent to display for a view from _selectView()"""
+        level, r0, r1, c0, c1 = view
+        source = self._source
+        if level == 0:
+            return source['data'][r0:r1, c0:c1], (c0-0.5, c1-0.5, r1-0.5, r0-0.5)
+        f = 2**level
+        arr = source['orient'](source['getlevel'](level))
+        lr0, lc0 = r0//f, c0//f
+        lr1, lc1 = min(arr.shape[0], -(-r1//f)), min(arr.shape[1], -(-c1//f))
+        return arr[lr0:lr1, lc0:lc1], (lc0*f-0.5, lc1*f-0.5, lr1*f-0.5, lr0*f-0.5)
+
+    def _applyView(self, ax, ax_img):
+        if self.multires:
+            view = self._selectView(ax, self._source['data'].shape, self._source['getlevel'])
+        else:
+            h, w = self._source['data'].shape[:2]
+            view = (0, 0, h, 0, w)
+        arr, extent = self._viewData(view)
+        ax_img.set_data(arr)
+        ax_img.set_extent(extent)
+        self._view = view
+
+    def _onLimitsChanged(self, ax):
+        # zoom/pan changed the visible region; pick a new level/region once the interaction settles
+        if self.multires and self._source is not None:
+            self._view_timer.start()
+
+    def _refreshView(self):
+        if self.ax_ct is None or self._source is None or not self.ax_ct.get_images():
+            return
+        view = self._selectView(self.ax_ct, self._source['data'].shape, self._source['getlevel'])
+        if view != self._view:
+            self._applyView(self.ax_ct, self.ax_ct.get_images()[0])
+            self.canvas.draw_idle()
+
+    def drawImage(self, ax, data, cmap='gray', flipx=False, flipy=False, aspect_ratio=None, volume_stats=None, getlevel=None,
+                  overlay=None):
+        """update ax with new image data, and the contour layer to overlay (RGBA, see MaskOverlay) if given
 
-    def drawImage(self, ax, data, cmap='gray', flipx=False, flipy=False, aspect_ratio=None):
-        """update ax with new image data"""
+        with autoscale enabled, the color limits follow each slice unless volume_stats are given and
+        autoscale_mode selects volume-wide or percentile windowing.
+        getlevel(level) may supply the slice downsampled by 2**level (e.g. ImageDataProvider.getImageSliceLevel).
+        With multires enabled the level drawn then follows the canvas size and zoom, and only the visible
+        region is handed to matplotlib
+        """
+        perf = getPerfStats()
+        with perf.timer('render', backend='matplotlib'):
+            self._drawImage(ax, data, cmap, flipx, flipy, aspect_ratio, volume_stats, getlevel, overlay)
+        perf.frame()
+
+    def _drawImage(self, ax, data, cmap, flipx, flipy, aspect_ratio, volume_stats, getlevel, overlay):
         if (not self._initialized):
             self.Build()
 
-        if flipx:
-            data = np.fliplr(data)
-        if flipy:
-            data = np.flipud(data)
+        if data.dtype.kind == 'f' and data.dtype.itemsize < 4:
+            # half precision volumes are converted per slice, at draw time
+            data = data.astype(np.float32)
+        def orient(arr):
+            if flipx:
+                arr = np.fliplr(arr)
+            if flipy:
+                arr = np.flipud(arr)
+            return arr
+        data = orient(data)
+        self._source = {'data': data, 'getlevel': getlevel, 'orient': orient}
 
+        full_redraw = not self.fastredraw or self._background is None
         # if nothing is drawn yet, add axes instance
         if len(ax.get_images()) == 0:
             try:
@@ -132,57 +463,1370 @@ class FigureDefinition_Summary(baseFigureDefinition):
             except Exception as e:
                 print(e)
                 return
+            ax_img.set_animated(self.fastredraw)
+            # limits are managed explicitly from here on, so that extents of the displayed level/region
+            # don't reset the zoom
+            ax.set_autoscale_on(False)
+            self._datashape = data.shape
+            full_redraw = True
             # fit imageAxes to current data extents
             # ax.autoscale(enable=True)
         else:
             ax_img = ax.get_images()[0]
-            ax_img.set_array(data)
-            # ax.relim()  # update axes limits
-            ax.autoscale_view()
-            if self.autoscale:
-                ax_img.autoscale()  # scale colormap to current data (vmin/vmax)
-        if self.colorbar_enabled:
-            plt.colorbar(ax_img, self.ax_colorbar)
-        if not self.autoscale:
+            if self._datashape != data.shape:
+                # extents changed, rescale axes to the new data
+                h, w = data.shape[:2]
+                ax.set_xlim(-0.5, w-0.5)
+                ax.set_ylim(h-0.5, -0.5)
+                self._datashape = data.shape
+                full_redraw = True
+        self._applyView(ax, ax_img)
+        if self.autoscale and self.volumeClim(volume_stats) is None:
+            ax_img.autoscale()  # scale colormap to current data (vmin/vmax)
+        if self.autoscale:
+            clim = self.volumeClim(volume_stats)
+            if clim is not None:
+                ax_img.set_clim(*clim)
+        else:
             if self.clim is not None:
                 ax_img.set_clim(*self.clim)
                 self.clim = None
-        self.canvas.draw()
+        if self.colorbar_enabled:
+            # colorbar is part of the static background; only redraw it when the clim changes
+            if self.colorbar is None:
+                self.colorbar = self.figure.colorbar(ax_img, cax=self.ax_colorbar)
+                self._colorbar_clim = ax_img.get_clim()
+                full_redraw = True
+            elif ax_img.get_clim() != self._colorbar_clim:
+                self.colorbar.update_normal(ax_img)
+                self._colorbar_clim = ax_img.get_clim()
+                full_redraw = True
+        self._setOverlay(ax, overlay)
+        if full_redraw:
+            with getPerfStats().timer('canvas.draw'):
+                self.canvas.draw()
+        else:
+            with getPerfStats().timer('canvas.blit'):
+                self._blit()
 
     def clearContour(self, ax):
-        try:
-            if self.contours is not None:
-                for c in self.contours.collections:
-                    c.remove()
-                self.canvas.draw()
-        except:
-            pass
+        """hide the contour layer, keeping its artist for the next slice"""
+        if self.contours is not None and self.contours.get_visible():
+            self._setOverlay(ax, None)
+            self._redrawOverlay()
 
     def drawContour(self, ax, maskdata):
-        self.clearContour(ax)
-        self.contours = ax.contour(maskdata, levels=[0], colors=['red'])
-        # ax.relim()
-        # ax.autoscale_view()
-        self.canvas.draw()
+        """outline maskdata > 0 (or each label of an integer label slice) in red"""
+        self.drawOverlay(ax, edgeLayer(maskdata, color=(255, 0, 0)))
+
+    def drawOverlay(self, ax, layer):
+        """show an RGBA layer (e.g. from MaskOverlay.getLayer) over the current slice
+
+        all structures share this single image artist, which is updated in place and blitted with the slice
+        """
+        if self._source is None:
+            return
+        self._setOverlay(ax, layer)
+        self._redrawOverlay()
+
+    def _setOverlay(self, ax, layer):
+        """update the contour layer artist without redrawing; None hides it"""
+        if layer is None:
+            if self.contours is not None:
+                self.contours.set_visible(False)
+            return
+        layer = self._source['orient'](layer)
+        h, w = layer.shape[:2]
+        extent = (-0.5, w-0.5, h-0.5, -0.5)
+        if self.contours is None or self.contours.axes is not ax:
+            self.contours = ax.imshow(layer, interpolation='nearest', extent=extent, zorder=2, aspect=ax.get_aspect())
+            self.contours.set_animated(self.fastredraw)
+        else:
+            self.contours.set_data(layer)
+            self.contours.set_extent(extent)
+            self.contours.set_visible(True)
+
+    def _redrawOverlay(self):
+        if self.fastredraw and self._background is not None:
+            with getPerfStats().timer('canvas.blit'):
+                self._blit()
+        else:
+            with getPerfStats().timer('canvas.draw'):
+                self.canvas.draw()
 
     def sliceCount(self, filepath, orientation=0):
         return self.ctprovider.getSliceCount(filepath, orientation)
 
+def labelEdges(labels):
+    """boundary pixels of each nonzero label in a 2d slice as (rows, cols, labels)
+
+    float/bool slices are treated as binary masks (> 0). A pixel is on the boundary when a 4-neighbour (or the
+    image border) has a different label
+    """
+    labels = np.asarray(labels)
+    if labels.dtype.kind in 'fb':
+        labels = (labels > 0).view(np.uint8) if labels.dtype.kind == 'b' else (labels > 0).astype(np.uint8)
+    padded = np.pad(labels, 1)
+    center = padded[1:-1, 1:-1]
+    edge = ((center != padded[:-2, 1:-1]) | (center != padded[2:, 1:-1]) |
+            (center != padded[1:-1, :-2]) | (center != padded[1:-1, 2:]))
+    edge &= (center != 0)
+    rows, cols = np.nonzero(edge)
+    return rows.astype(np.int32), cols.astype(np.int32), labels[rows, cols]
+
+def edgeLayer(labels, color=(255, 0, 0)):
+    """RGBA layer (transparent background) outlining the labels of a 2d slice in a single color"""
+    rows, cols, _ = labelEdges(labels)
+    layer = np.zeros(np.shape(labels)[:2]+(4,), dtype=np.uint8)
+    layer[rows, cols] = tuple(color)+(255,)
+    return layer
+
+def fileStamp(filepath):
+    """cheap fingerprint used to detect that a file (or dicom series directory) changed on disk"""
+    st = os.stat(filepath)
+    return (st.st_mtime_ns, st.st_size)
+
+def statsClim(stats, mode='volume', percentile_clip=(1, 99)):
+    """color limits from volume-wide stats for autoscale mode 'volume' or 'percentile', None for 'slice'"""
+    if stats is None or mode == 'slice':
+        return None
+    if mode == 'percentile':
+        lo, hi = percentile_clip
+        pct = stats['percentiles']
+        if lo in pct and hi in pct:
+            return (pct[lo], pct[hi])
+        # interpolate from the histogram when the requested percentiles weren't precomputed
+        cdf = np.cumsum(stats['hist'])/max(1, np.sum(stats['hist']))
+        return tuple(float(np.interp(p/100.0, cdf, stats['bin_edges'][1:])) for p in (lo, hi))
+    return (stats['min'], stats['max'])
+
+def computeVolumeStats(vol, percentiles=(0.5, 1, 2, 5, 95, 98, 99, 99.5), bins=256, max_samples=2**22, chunk_bytes=64*1024**2):
+    """volume-wide intensity statistics from a single chunked pass along the slowest axis
+
+    min/max are exact. Percentiles and the histogram are computed from an evenly strided sample of at most
+    max_samples voxels (exact for smaller volumes), so only one chunk of the volume is in memory at a time,
+    which makes this safe to run over memmapped data
+    """
+    if isinstance(vol, DicomVolume):
+        # decode the series once, rather than block by block here and again for other views
+        vol.materialize()
+    shape = vol.shape
+    nvoxels = int(np.prod(shape))
+    slicebytes = max(1, int(np.prod(shape[1:]))*np.dtype(vol.dtype).itemsize)
+    chunk = max(1, int(chunk_bytes//slicebytes))
+    step = max(1, int(np.ceil(nvoxels/max_samples)))
+    vmin, vmax = np.inf, -np.inf
+    samples = []
+    offset = 0
+    for ii in range(0, shape[0], chunk):
+        block = np.asarray(vol[ii:ii+chunk]).ravel()
+        # keep the global stride through the volume when sampling across chunk boundaries
+        start = (-offset) % step
+        offset += block.size
+        sample = block[start::step]
+        if not np.issubdtype(sample.dtype, np.integer):
+            sample = sample[np.isfinite(sample)]
+        if sample.size == 0 and block.size == 0:
+            continue
+        if np.issubdtype(block.dtype, np.integer):
+            vmin = min(vmin, block.min())
+            vmax = max(vmax, block.max())
+        else:
+            finite = block[np.isfinite(block)]
+            if finite.size:
+                vmin = min(vmin, finite.min())
+                vmax = max(vmax, finite.max())
+        samples.append(sample)
+    if not np.isfinite(vmin):
+        return None
+    samples = np.concatenate(samples)
+    hist, bin_edges = np.histogram(samples, bins=bins, range=(float(vmin), float(vmax)))
+    return {'min': float(vmin),
+            'max': float(vmax),
+            'percentiles': dict(zip(percentiles, [float(x) for x in np.percentile(samples, percentiles)])),
+            'hist': hist*(nvoxels/max(1, samples.size)),
+            'bin_edges': bin_edges,
+            }
+
+class BaseVolume:
+    """volume that serves slices on demand instead of being fully materialized in memory
+
+    loaders return a subclass implementing getSlice(); getBlock() may be overridden where reading a run of
+    slices at once is cheaper than reading them one by one. Basic numpy-style indexing of single slices and
+    of blocks along the first axis is supported so volumes can be used where an ndarray was expected
+    """
+    __metaclass__ = ABCMeta
+    def __init__(self, shape, dtype, affine=None):
+        self.shape = tuple(int(x) for x in shape)
+        self.dtype = np.dtype(dtype)
+        self.affine = affine
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def size(self):
+        return int(np.prod(self.shape))
+
+    @property
+    def nbytes(self):
+        """estimate of the memory held by the volume (used by the cache budget)"""
+        return 0
+
+    def __len__(self):
+        return self.shape[0]
+
+    @abstractmethod
+    def getSlice(self, axis, index):
+        """return the 2d slice at index along axis"""
+        return
+
+    def getBlock(self, start, stop, axis=0):
+        """return the slices [start, stop) along axis as one array"""
+        start, stop, _ = slice(start, stop).indices(self.shape[axis])
+        slices = [self.getSlice(axis, ii) for ii in range(start, stop)]
+        if not slices:
+            shape = list(self.shape)
+            shape[axis] = 0
+            return np.empty(shape, dtype=self.dtype)
+        return np.stack(slices, axis=axis)
+
+    def getRegion(self, start, stop):
+        """return the box [start, stop) given as (z, y, x) bounds, reading only that part where the source allows"""
+        block = self.getBlock(start[0], stop[0])
+        return block[:, start[1]:stop[1], start[2]:stop[2]]
+
+    def __getitem__(self, idx):
+        if not isinstance(idx, tuple):
+            idx = (idx,)
+        idx = idx + (slice(None),)*(self.ndim-len(idx))
+        isfull = [isinstance(x, slice) and x == slice(None) for x in idx]
+        ints = [ii for ii, x in enumerate(idx) if isinstance(x, (int, np.integer))]
+        if len(ints) == 1 and all(isfull[ii] for ii in range(self.ndim) if ii != ints[0]):
+            axis = ints[0]
+            index = int(idx[axis])
+            if index < 0:
+                index += self.shape[axis]
+            if not 0 <= index < self.shape[axis]:
+                raise IndexError('index {:d} is out of bounds for axis {:d} with size {:d}'.format(int(idx[axis]), axis, self.shape[axis]))
+            return self.getSlice(axis, index)
+        if isinstance(idx[0], slice):
+            start, stop, step = idx[0].indices(self.shape[0])
+            block = self.getBlock(start, stop) if step > 0 else self.getBlock(stop+1, start+1)[::-1]
+            return block[(slice(None, None, abs(step)),)+idx[1:]]
+        return self.getSlice(0, int(idx[0]) % self.shape[0])[idx[1:]]
+
+    def __array__(self, dtype=None, copy=None):
+        arr = self.getBlock(0, self.shape[0])
+        return arr if dtype is None else arr.astype(dtype)
+
+    # 3d volumes are a single frame; time series (4d) volumes serve slices of the selected frame
+    nframes = 1
+    frame = 0
+
+    def setFrame(self, frame):
+        if frame != 0:
+            raise IndexError('volume has a single frame')
+
+    def refresh(self):
+        """pick up data appended to the file since it was opened
+
+        returns False if a full reload is needed, or the volume replacing this one if the data no longer fits it
+        (e.g. a single raw volume grown into a time series)
+        """
+        return False
+
+    def needsFullRead(self, axis):
+        """True if slices along axis are only available after reading the whole volume (see readAll)"""
+        return False
+
+    def readAll(self, progress=None):
+        """read the whole volume where some slices need it. Slow, meant for worker threads"""
+        return
+
+    def close(self):
+        return
+
+class ArrayVolume(BaseVolume):
+    """in-memory or memory-mapped ndarray
+
+    with a reopen() callable mapping the file again as a (t, z, y, x) series, refresh() picks up volumes
+    appended to a growing file
+    """
+    def __init__(self, array, affine=None, reopen=None):
+        super().__init__(array.shape, array.dtype, affine)
+        self.array = array
+        self._reopen = reopen
+
+    # charged to the cache for memory-mapped arrays, whose pages are held by the OS page cache and not the process
+    memmap_nbytes = 1024**2
+
+    @property
+    def nbytes(self):
+        if isinstance(self.array, np.memmap):
+            return self.memmap_nbytes
+        return self.array.nbytes
+
+    def getSlice(self, axis, index):
+        return self.array[(slice(None),)*axis + (index,)]
+
+    def getBlock(self, start, stop, axis=0):
+        return self.array[(slice(None),)*axis + (slice(start, stop),)]
+
+    def getRegion(self, start, stop):
+        return self.array[tuple(slice(a, b) for a, b in zip(start, stop))]
+
+    def refresh(self):
+        if self._reopen is None:
+            return False
+        try:
+            source = self._reopen()
+        except Exception as e:
+            print(e)
+            return False
+        if tuple(source.shape[1:]) != self.shape:
+            return False
+        if source.shape[0] == 1:
+            self.array = source[0]
+            return True
+        # more volumes were appended: continue as a series, keeping the element type the file was opened with
+        return TimeSeriesVolume(source, self.affine, reopen=self._reopen)
+
+class H5Volume(BaseVolume):
+    """HDF5 dataset kept open and read lazily, one slice (or block) per request
+
+    h5py only reads and decompresses the chunks touched by a selection. The file is opened with a
+    small raw chunk cache so that scrolling through chunked/compressed data doesn't decode the same
+    chunks again for neighbouring slices
+    """
+    def __init__(self, filepath, key, chunk_cache_bytes=32*1024**2):
+        self.filepath = filepath
+        self.key = key
+        self.chunk_cache_bytes = chunk_cache_bytes
+        self.file = None
+        self._open()
+        super().__init__(self.dataset.shape, self.dataset.dtype)
+        self.chunks = self.dataset.chunks
+
+    def _open(self):
+        import h5py
+        try:
+            # without file locking, the open file doesn't keep a writer from extending it
+            self.file = h5py.File(self.filepath, 'r', rdcc_nbytes=self.chunk_cache_bytes, rdcc_nslots=10007, locking=False)
+        except TypeError:
+            # h5py < 3.5
+            self.file = h5py.File(self.filepath, 'r', rdcc_nbytes=self.chunk_cache_bytes, rdcc_nslots=10007)
+        try:
+            self.dataset = self.file[self.key]
+            if not isinstance(self.dataset, h5py.Dataset):
+                raise KeyError('"{!s}" is not a dataset'.format(self.key))
+        except Exception:
+            self.file.close()
+            raise
+
+    def reopen(self):
+        """reopen the file to see datasets extended by a writer since it was opened, returning the dataset"""
+        self.close()
+        self._open()
+        return self.dataset
+
+    def refresh(self):
+        shape = self.shape
+        try:
+            self.reopen()
+        except Exception as e:
+            print(e)
+            return False
+        if self.dataset.shape[1:] != shape[1:] or self.dataset.shape[0] < shape[0]:
+            return False
+        # only the new slices along the first axis will be read, as they are requested
+        self.shape = tuple(int(x) for x in self.dataset.shape)
+        return True
+
+    @property
+    def nbytes(self):
+        # memory held is bounded by the chunk cache, not the size of the dataset
+        return self.chunk_cache_bytes
+
+    def getSlice(self, axis, index):
+        return self.dataset[(slice(None),)*axis + (index,)]
+
+    def getBlock(self, start, stop, axis=0):
+        return self.dataset[(slice(None),)*axis + (slice(start, stop),)]
+
+    def getRegion(self, start, stop):
+        # only the chunks intersecting the box are read
+        return self.dataset[tuple(slice(a, b) for a, b in zip(start, stop))]
+
+    def __array__(self, dtype=None, copy=None):
+        arr = self.dataset[()]
+        return arr if dtype is None else arr.astype(dtype)
+
+    def close(self):
+        try:
+            self.file.close()
+        except Exception:
+            pass
+
+    def __del__(self):
+        self.close()
+
+class DicomVolume(BaseVolume):
+    """dicom series decoded one slice (file) at a time as slices are requested
+
+    pixel data is kept in its stored integer type; the per-slice rescale slope/intercept is applied to each
+    slice or block as it is returned. Decoded axial slices are kept in a small LRU. Coronal/sagittal slices
+    need every file, so the first such request decodes the full series once with the provided (parallel) decoder
+    """
+    def __init__(self, series, decoder, max_cached_slices=32):
+        self.raw_dtype = np.dtype(series['dtype'])
+        super().__init__(series['shape'], np.float32 if series['rescale'] else self.raw_dtype, series['affine'])
+        self.series = series
+        self.max_cached_slices = max_cached_slices
+        self._slopes = np.asarray(series.get('slopes', [1.0]*self.shape[0]), dtype=np.float32)
+        self._intercepts = np.asarray(series.get('intercepts', [0.0]*self.shape[0]), dtype=np.float32)
+        self._decoder = decoder
+        self._slices = OrderedDict()
+        self._full = None
+        self._lock = threading.Lock()
+        self._materialize_lock = threading.Lock()
+
+    @property
+    def nbytes(self):
+        if self._full is not None:
+            return self._full.nbytes
+        return self.max_cached_slices*int(np.prod(self.shape[1:]))*self.raw_dtype.itemsize
+
+    def _subSeries(self, start, stop):
+        sub = dict(self.series)
+        sub['files'] = self.series['files'][start:stop]
+        sub['shape'] = (len(sub['files']),)+tuple(self.shape[1:])
+        return sub
+
+    def _rescale(self, raw, zslice, zaxis):
+        """apply rescale of slices zslice (index or slice along the series) to raw data with z along zaxis"""
+        if not self.series['rescale']:
+            return raw
+        slopes, intercepts = self._slopes[zslice], self._intercepts[zslice]
+        if zaxis is not None and np.ndim(slopes):
+            shape = [1]*raw.ndim
+            shape[zaxis] = -1
+            slopes, intercepts = slopes.reshape(shape), intercepts.reshape(shape)
+        return raw.astype(np.float32)*slopes + intercepts
+
+    def materialize(self, progress=None):
+        """decode the entire series into memory, returning the stored (z, y, x) array without rescaling"""
+        with self._materialize_lock:
+            # concurrent callers wait for the first full decode instead of starting their own
+            if self._full is None:
+                full = self._decoder(self.series, progress=progress)
+                with self._lock:
+                    self._full = full
+                    self._slices.clear()
+        return self._full
+
+    def needsFullRead(self, axis):
+        return axis != 0 and self._full is None
+
+    def readAll(self, progress=None):
+        self.materialize(progress)
+
+    def getSlice(self, axis, index):
+        if self._full is not None or axis != 0:
+            raw = self.materialize()[(slice(None),)*axis + (index,)]
+            return self._rescale(raw, index if axis == 0 else slice(None), None if axis == 0 else 0)
+        with self._lock:
+            arr = self._slices.get(index, None)
+            if arr is not None:
+                self._slices.move_to_end(index)
+                return self._rescale(arr, index, None)
+        arr = _decodeDicomFiles([self.series['files'][index]])[0]
+        with self._lock:
+            self._slices[index] = arr
+            while len(self._slices) > self.max_cached_slices:
+                self._slices.popitem(last=False)
+        return self._rescale(arr, index, None)
+
+    def getBlock(self, start, stop, axis=0):
+        if self._full is not None or axis != 0:
+            raw = self.materialize()[(slice(None),)*axis + (slice(start, stop),)]
+            return self._rescale(raw, slice(start, stop) if axis == 0 else slice(None), 0)
+        start, stop, _ = slice(start, stop).indices(self.shape[0])
+        return self._rescale(self._decoder(self._subSeries(start, stop)), slice(start, stop), 0)
+
+class NpzVolume(BaseVolume):
+    """single array of an npz archive
+
+    arrays stored uncompressed are memory-mapped directly from their offset within the zip file;
+    compressed arrays are decompressed the first time they are accessed
+    """
+    def __init__(self, filepath, name):
+        import zipfile
+        self.filepath = filepath
+        self.name = name
+        self._array = None
+        self._lock = threading.Lock()
+        with zipfile.ZipFile(filepath) as zf:
+            info = zf.getinfo(name if name.endswith('.npy') else name+'.npy')
+            shape, fortran_order, dtype, offset = self.memberHeader(zf, info)
+        self.compressed = offset is None
+        if not self.compressed:
+            self._array = np.memmap(filepath, dtype=dtype, mode='r', offset=offset, shape=shape,
+                                    order='F' if fortran_order else 'C')
+        super().__init__(shape, dtype)
+
+    @staticmethod
+    def _readHeader(fd):
+        version = np.lib.format.read_magic(fd)
+        if version == (1, 0):
+            return np.lib.format.read_array_header_1_0(fd)
+        return np.lib.format.read_array_header_2_0(fd)
+
+    @classmethod
+    def memberHeader(cls, zf, info):
+        """(shape, fortran_order, dtype, data offset) of an npy member of an open zip file from its header alone
+
+        the offset of the array data within the zip file is None for compressed members, whose header is read
+        by decompressing only its first block
+        """
+        import zipfile
+        if info.compress_type != zipfile.ZIP_STORED:
+            with zf.open(info) as fd:
+                return cls._readHeader(fd) + (None,)
+        with open(zf.filename, 'rb') as fd:
+            # local file header: 30 fixed bytes followed by the file name and extra field
+            fd.seek(info.header_offset)
+            header = fd.read(30)
+            namelen, extralen = struct.unpack('<HH', header[26:30])
+            fd.seek(info.header_offset + 30 + namelen + extralen)
+            shape, fortran_order, dtype = cls._readHeader(fd)
+            return shape, fortran_order, dtype, fd.tell()
+
+    @property
+    def nbytes(self):
+        if not self.compressed:
+            return ArrayVolume.memmap_nbytes
+        # charged up front: the member is decompressed into memory on first access, without going through the cache
+        return int(np.prod(self.shape))*np.dtype(self.dtype).itemsize
+
+    def _getArray(self):
+        with self._lock:
+            if self._array is None:
+                with np.load(self.filepath) as data:
+                    self._array = data[self.name]
+        return self._array
+
+    def getSlice(self, axis, index):
+        return self._getArray()[(slice(None),)*axis + (index,)]
+
+    def getBlock(self, start, stop, axis=0):
+        return self._getArray()[(slice(None),)*axis + (slice(start, stop),)]
+
+    def getRegion(self, start, stop):
+        return self._getArray()[tuple(slice(a, b) for a, b in zip(start, stop))]
+
+def listNpzArrays(filepath):
+    """(name, shape, dtype) of each array in an npz archive, from the zip directory and npy headers only"""
+    import zipfile
+    if not zipfile.is_zipfile(filepath):
+        return []
+    arrays = []
+    with zipfile.ZipFile(filepath) as zf:
+        for info in zf.infolist():
+            if not info.filename.endswith('.npy'):
+                continue
+            shape, fortran_order, dtype, offset = NpzVolume.memberHeader(zf, info)
+            arrays.append((info.filename[:-4], tuple(shape), str(dtype)))
+    return arrays
+
+def listH5Arrays(filepath):
+    """(name, shape, dtype) of each dataset in an hdf5 file (also matlab v7.3), without reading any data"""
+    import h5py
+    arrays = []
+    def visit(name, obj):
+        if isinstance(obj, h5py.Dataset):
+            arrays.append((name, tuple(obj.shape), str(obj.dtype)))
+    with h5py.File(filepath, 'r') as f:
+        f.visititems(visit)
+    return arrays
+
+def listMatArrays(filepath):
+    """(name, shape, class) of each variable in a matlab v5 file, as listed by whosmat"""
+    from scipy.io import whosmat
+    return [(name, tuple(shape), cls) for name, shape, cls in whosmat(filepath)]
+
+class TimeSeriesVolume(BaseVolume):
+    """4d (t, z, y, x) data viewed one 3d frame at a time
+
+    the volume has the shape of a single frame and serves slices of the frame selected with setFrame(), read
+    directly from the source (ndarray/memmap or hdf5 dataset) so only frames that are viewed are read. Slices of
+    recently viewed frames are kept in a cache bounded by max_cache_bytes, so that stepping back and forth
+    through time at a fixed slice reads each frame's slice once. With a reopen() callable returning the source
+    again, refresh() picks up frames appended to a growing file without discarding the cache
+    """
+    def __init__(self, source, affine=None, reopen=None, close=None, max_cache_bytes=64*1024**2):
+        super().__init__(source.shape[1:], source.dtype, affine)
+        self.source = source
+        self.nframes = int(source.shape[0])
+        self.frame = 0
+        self.max_cache_bytes = max_cache_bytes
+        self._reopen = reopen
+        self._close = close
+        self._slices = OrderedDict()
+        self._cached_bytes = 0
+        self._lock = threading.Lock()
+
+    @property
+    def nbytes(self):
+        held = self.max_cache_bytes
+        if isinstance(self.source, np.ndarray) and not isinstance(self.source, np.memmap):
+            held += self.source.nbytes
+        return held
+
+    def setFrame(self, frame):
+        if not 0 <= frame < self.nframes:
+            raise IndexError('frame {:d} is out of range for {:d} frames'.format(frame, self.nframes))
+        self.frame = int(frame)
+
+    def frameView(self, frame):
+        """a volume reading frame from the same source, unaffected by later setFrame() calls (e.g. for workers)"""
+        view = TimeSeriesVolume(self.source, self.affine, max_cache_bytes=0)
+        view.setFrame(frame)
+        return view
+
+    def getSlice(self, axis, index):
+        key = (self.frame, axis, index)
+        with self._lock:
+            arr = self._slices.get(key, None)
+            if arr is not None:
+                self._slices.move_to_end(key)
+                return arr
+        arr = np.array(self.source[(self.frame,) + (slice(None),)*axis + (index,)])
+        with self._lock:
+            if key not in self._slices:
+                self._slices[key] = arr
+                self._cached_bytes += arr.nbytes
+            while self._cached_bytes > self.max_cache_bytes and len(self._slices) > 1:
+                self._cached_bytes -= self._slices.popitem(last=False)[1].nbytes
+        return arr
+
+    def getBlock(self, start, stop, axis=0):
+        return np.asarray(self.source[(self.frame,) + (slice(None),)*axis + (slice(start, stop),)])
+
+    def getRegion(self, start, stop):
+        return np.asarray(self.source[(self.frame,) + tuple(slice(a, b) for a, b in zip(start, stop))])
+
+    def refresh(self):
+        if self._reopen is None:
+            return False
+        try:
+            source = self._reopen()
+        except Exception as e:
+            print(e)
+            return False
+        if tuple(source.shape[1:]) != self.shape or source.shape[0] < self.nframes:
+            return False
+        with self._lock:
+            # the last frame may have been incomplete when it was read
+            for key in [k for k in self._slices if k[0] >= self.nframes-1]:
+                self._cached_bytes -= self._slices.pop(key).nbytes
+            self.source = source
+            self.nframes = int(source.shape[0])
+        return True
+
+    def close(self):
+        if self._close is not None:
+            self._close()
+
+def asVolume(vol, affine=None):
+    """wrap loader results that are plain ndarrays in the BaseVolume interface (4d arrays as time series)"""
+    if isinstance(vol, BaseVolume):
+        if vol.affine is None:
+            vol.affine = affine
+        return vol
+    vol = np.asanyarray(vol)
+    if vol.ndim == 4:
+        return TimeSeriesVolume(vol, affine)
+    return ArrayVolume(vol, affine)
+
+def downsample2x(arr):
+    """2x2 block mean of a 2d array (trailing odd row/column is dropped)"""
+    h, w = (arr.shape[0]//2)*2, (arr.shape[1]//2)*2
+    arr = np.asarray(arr[:h, :w], dtype=np.float32)
+    return 0.25*(arr[0::2, 0::2] + arr[1::2, 0::2] + arr[0::2, 1::2] + arr[1::2, 1::2])
+
+def needsDowncast(dtype, target):
+    dtype, target = np.dtype(dtype), np.dtype(target)
+    return dtype.kind == 'f' and target.kind == 'f' and dtype.itemsize > target.itemsize
+
+def downcastVolume(vol, dtype, chunk_bytes=64*1024**2):
+    """convert in-memory float volumes to a lower precision dtype, a block at a time
+
+    memmapped and lazily read volumes are returned unchanged; they are converted per slice when read
+    """
+    if not isinstance(vol, ArrayVolume) or isinstance(vol.array, np.memmap) or not needsDowncast(vol.dtype, dtype):
+        return vol
+    src = vol.array
+    out = np.empty(src.shape, dtype=dtype)
+    step = max(1, int(chunk_bytes//max(1, int(np.prod(src.shape[1:]))*src.dtype.itemsize)))
+    for start in range(0, src.shape[0], step):
+        out[start:start+step] = src[start:start+step]
+    return ArrayVolume(out, vol.affine)
+
+def reorientVolume(vol, axis, out=None, chunk_bytes=64*1024**2):
+    """copy vol into a layout where slices along axis are contiguous (axis moved first)
+
+    the source is read in blocks along its slowest axis, so memmapped and lazy volumes are streamed
+    sequentially; out may be a preallocated (e.g. memmapped) array to write into
+    """
+    if isinstance(vol, DicomVolume):
+        vol.materialize()
+    shape = (vol.shape[axis],) + tuple(x for ii, x in enumerate(vol.shape) if ii != axis)
+    if out is None:
+        out = np.empty(shape, dtype=vol.dtype)
+    slicebytes = max(1, int(np.prod(vol.shape[1:]))*np.dtype(vol.dtype).itemsize)
+    step = max(1, int(chunk_bytes//slicebytes))
+    for start in range(0, vol.shape[0], step):
+        block = np.asarray(vol[start:start+step])
+        out[:, start:start+block.shape[0]] = np.moveaxis(block, axis, 0)
+    return out
+
+PROJECTIONS = ('max', 'min', 'mean')
+
+def _projectionUfunc(mode, dtype):
+    """(ufunc, accumulator dtype) reducing slices for a projection mode; NaNs are skipped by max/min"""
+    if mode == 'mean':
+        return np.add, np.float64 if np.dtype(dtype) == np.float64 else np.float32
+    if mode not in PROJECTIONS:
+        raise ValueError('unknown projection "{!s}", expected one of {!s}'.format(mode, PROJECTIONS))
+    if np.dtype(dtype).kind == 'f':
+        return (np.fmax if mode == 'max' else np.fmin), dtype
+    return (np.maximum if mode == 'max' else np.minimum), dtype
+
+def blockReduce(vol, axis, mode, block=8, chunk_bytes=64*1024**2, executor=None):
+    """reductions (max, min or sum for 'mean') over consecutive runs of block slices along axis
+
+    returns an array of shape (nblocks,) + slice shape, where entry b reduces slices [b*block, (b+1)*block).
+    The volume is read once in chunks along its slowest axis, so memmapped and lazy volumes are streamed
+    sequentially; with an executor, chunks are read and reduced on its threads
+    """
+    ufunc, dtype = _projectionUfunc(mode, vol.dtype)
+    n = vol.shape[axis]
+    nblocks = (n+block-1)//block
+    planeshape = tuple(x for ii, x in enumerate(vol.shape) if ii != axis)
+    out = np.empty((nblocks,)+planeshape, dtype=dtype)
+    slicebytes = max(1, int(np.prod(vol.shape[1:]))*np.dtype(vol.dtype).itemsize)
+    step = max(1, int(chunk_bytes//slicebytes))
+    if axis == 0:
+        # chunks hold whole blocks so that each block is reduced by one task
+        step = max(block, step//block*block)
+
+    def reduceBlocks(data, axis):
+        # combine every block-th slice elementwise: vectorized along the fast axes even when reducing the last one
+        reduced = data[(slice(None),)*axis + (slice(0, None, block),)].astype(dtype, copy=True)
+        for k in range(1, block):
+            part = data[(slice(None),)*axis + (slice(k, None, block),)]
+            acc = reduced[(slice(None),)*axis + (slice(0, part.shape[axis]),)]
+            ufunc(acc, part, out=acc)
+        return reduced
+
+    def reduceChunk(start):
+        data = np.asarray(vol.getBlock(start, min(start+step, vol.shape[0])))
+        if axis == 0:
+            out[start//block:(start+data.shape[0]+block-1)//block] = reduceBlocks(data, 0)
+        else:
+            out[:, start:start+data.shape[0]] = np.moveaxis(reduceBlocks(data, axis), axis, 0)
+
+    starts = range(0, vol.shape[0], step)
+    if executor is None:
+        for start in starts:
+            reduceChunk(start)
+    else:
+        for future in [executor.submit(reduceChunk, start) for start in starts]:
+            future.result()
+    return out
+
+class ObliqueReslicer:
+    """samples planes tilted away from the axial/coronal/sagittal orientations with isotropic physical spacing
+
+    the volume's affine maps (x, y, z) voxel indices to physical positions (identity if unknown). A plane is
+    the orientation's slice plane rotated by tilt = (a, b) degrees about its row and column directions; its
+    pixels and the steps between planes are spaced by the smallest voxel spacing, so anisotropic CT is
+    resampled to square pixels. Images cover the volume's extent within the plane, with NaN outside.
+
+    geometry and the voxel coordinates of the central plane are computed once per volume geometry, orientation
+    and tilt (kept in an LRU); stepping along the normal only offsets the cached coordinates, and each slice is
+    a single trilinear map_coordinates pass over the box of voxels the plane passes through (see getRegion)
+    """
+    def __init__(self, max_cached_grids=16):
+        self.max_cached_grids = max_cached_grids
+        self._geometry = OrderedDict()
+        self._lock = threading.Lock()
+
+    # in-plane column/row directions and normal of each orientation, as (x, y, z) affine columns, matching
+    # the layout of BaseVolume.getSlice(orientation)
+    _axes = {0: (0, 1, 2), 1: (0, 2, 1), 2: (1, 2, 0)}
+
+    @staticmethod
+    def _rotation(a, b):
+        a, b = np.radians(a), np.radians(b)
+        # tilt the normal towards the columns (about the rows' direction), then towards the rows
+        ra = np.array([[np.cos(a), 0, -np.sin(a)], [0, 1, 0], [np.sin(a), 0, np.cos(a)]])
+        rb = np.array([[1, 0, 0], [0, np.cos(b), -np.sin(b)], [0, np.sin(b), np.cos(b)]])
+        return ra.dot(rb)
+
+    def geometry(self, shape, affine, orientation, tilt=(0.0, 0.0)):
+        """sampling grid of the planes through a volume of shape (z, y, x) for an orientation and tilt"""
+        affine = np.identity(4) if affine is None else np.asarray(affine, dtype=np.float64)
+        key = (tuple(shape), affine.tobytes(), orientation, (float(tilt[0]), float(tilt[1])))
+        with self._lock:
+            geom = self._geometry.get(key, None)
+            if geom is not None:
+                self._geometry.move_to_end(key)
+                return geom
+        M, t = affine[:3, :3], affine[:3, 3]
+        spacing = float(np.min(np.linalg.norm(M, axis=0)))
+        cu, cv, cn = self._axes[orientation]
+        # orthonormal frame of the untilted plane, then rotated in its own coordinates
+        u = M[:, cu]/np.linalg.norm(M[:, cu])
+        v = M[:, cv]-u*u.dot(M[:, cv])
+        v /= np.linalg.norm(v)
+        n = np.cross(u, v)
+        if n.dot(M[:, cn]) < 0:
+            n = -n
+        frame = np.stack([u, v, n], axis=1).dot(self._rotation(*tilt))
+        # extent of the volume's corners along each direction of the frame
+        nx, ny, nz = shape[2], shape[1], shape[0]
+        corners = np.array([[x, y, z] for x in (0, nx-1) for y in (0, ny-1) for z in (0, nz-1)], dtype=np.float64)
+        phys = corners.dot(M.T) + t
+        center = phys.mean(axis=0)
+        extent = (phys-center).dot(frame)
+        lo = extent.min(axis=0)
+        count = np.floor((extent.max(axis=0)-lo)/spacing).astype(int)+1
+        Minv = np.linalg.inv(M)
+        toindex = lambda p: Minv.dot(p)[::-1]  # physical offset to (z, y, x) index offset
+        origin = toindex(center + frame.dot(lo) - t)
+        steps = [toindex(frame[:, ii]*spacing) for ii in range(3)]
+        # voxel coordinates of the first plane, offset by a multiple of the normal step for the others
+        rows = np.arange(count[1], dtype=np.float32)
+        cols = np.arange(count[0], dtype=np.float32)
+        grid = (origin.astype(np.float32)[:, None, None]
+                + steps[1].astype(np.float32)[:, None, None]*rows[None, :, None]
+                + steps[0].astype(np.float32)[:, None, None]*cols[None, None, :])
+        geom = {'shape': (int(count[1]), int(count[0])), 'count': int(count[2]), 'spacing': spacing,
+                'grid': grid, 'normal_step': steps[2].astype(np.float32), 'volume_shape': tuple(shape)}
+        with self._lock:
+            self._geometry[key] = geom
+            while len(self._geometry) > self.max_cached_grids:
+                self._geometry.popitem(last=False)
+        return geom
+
+    def sliceCount(self, vol, orientation, tilt=(0.0, 0.0)):
+        return self.geometry(vol.shape, vol.affine, orientation, tilt)['count']
+
+    def getSlice(self, vol, orientation, index, tilt=(0.0, 0.0)):
+        """float32 image of plane index (0 <= index < sliceCount()) through vol"""
+        from scipy.ndimage import map_coordinates
+        geom = self.geometry(vol.shape, vol.affine, orientation, tilt)
+        coords = geom['grid'] + (geom['normal_step']*index)[:, None, None]
+        # only the box of voxels around the plane is read, on every axis
+        start, stop = [], []
+        for axis in range(3):
+            start.append(max(0, int(np.floor(coords[axis].min()))))
+            stop.append(min(vol.shape[axis], int(np.ceil(coords[axis].max()))+1))
+            if stop[axis] <= start[axis]:
+                return np.full(geom['shape'], np.nan, dtype=np.float32)
+        block = np.asarray(vol.getRegion(start, stop))
+        for axis in range(3):
+            coords[axis] -= start[axis]
+        # samples outside the volume are NaN, without interpolating them
+        return map_coordinates(block, coords, order=1, mode='constant', cval=np.nan, output=np.float32)
+
+class VolumeCache:
+    """keyed LRU cache of loaded volumes bounded by a memory budget (in bytes)
+
+    each entry holds the volume, a metadata dict (size, affine, ...) and the file stamp at load time.
+    entries whose file has since been modified are dropped on lookup.
+    """
+    def __init__(self, max_bytes=2*1024**3):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def _stamp(key):
+        try:
+            return fileStamp(key)
+        except Exception:
+            return None
+
+    def get(self, key):
+        """return cache entry for key (marking it most-recently-used) or None on miss"""
+        with self._lock:
+            entry = self._entries.get(key, None)
+            if entry is not None and entry['stamp'] != self._stamp(key):
+                self.invalidations += 1
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, volume, meta=None):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            entry = {'volume': volume,
+                     'meta': dict(meta) if meta else {},
+                     'stamp': self._stamp(key),
+                     'nbytes': int(getattr(volume, 'nbytes', 0)),
+                     }
+            self._entries[key] = entry
+            self.nbytes += entry['nbytes']
+            self._evict(keep=key)
+            return entry
+
+    def peek(self, key):
+        """return cache entry for key without checking its file stamp or changing the LRU order"""
+        with self._lock:
+            return self._entries.get(key, None)
+
+    def account(self, key, nbytes):
+        """charge memory used by data derived from an entry (e.g. reoriented copies) to its budget"""
+        with self._lock:
+            entry = self._entries.get(key, None)
+            if entry is None:
+                return
+            entry['nbytes'] += int(nbytes)
+            self.nbytes += int(nbytes)
+            self._evict(keep=key)
+
+    def invalidate(self, key=None):
+        """drop a single entry, or every entry if key is None"""
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+                self.nbytes = 0
+            elif key in self._entries:
+                self._remove(key)
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self.nbytes -= entry['nbytes']
+        return entry
+
+    def _evict(self, keep=None):
+        # least-recently-used entries are evicted first. The most recent entry is always kept
+        # even if it alone exceeds the budget
+        while self.nbytes > self.max_bytes and len(self._entries) > 1:
+            key = next(iter(self._entries))
+            if key == keep:
+                break
+            self._remove(key)
+            self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries),
+                    'nbytes': self.nbytes,
+                    'max_bytes': self.max_bytes,
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions,
+                    'invalidations': self.invalidations,
+                    }
+
+class DicomSeriesIndex:
+    """persistent (sqlite) index of dicom series directories
+
+    records whether a directory holds dicom files (and subdirectories) and, once a series has been scanned, its
+    slice ordering, shape, dtype and affine so that listing and re-opening known series can skip the header scan.
+    Entries are keyed by directory path and invalidated when the directory's mtime changes.
+    """
+    def __init__(self, dbpath=None):
+        if dbpath is None:
+            dbpath = os.path.join(getCacheDir(), 'dicom_index.sqlite')
+        self.dbpath = dbpath
+        self._db = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._db is None:
+            import sqlite3
+            if self.dbpath != ':memory:':
+                os.makedirs(os.path.dirname(self.dbpath), exist_ok=True)
+            self._db = sqlite3.connect(self.dbpath, check_same_thread=False)
+            self._db.execute('CREATE TABLE IF NOT EXISTS series ('
+                             'path TEXT PRIMARY KEY, mtime INTEGER, has_dicom INTEGER, info TEXT, leaf INTEGER)')
+            if 'leaf' not in [col[1] for col in self._db.execute('PRAGMA table_info(series)')]:
+                # index written before subdirectories were recorded
+                self._db.execute('ALTER TABLE series ADD COLUMN leaf INTEGER')
+        return self._db
+
+    @staticmethod
+    def _mtime(dirpath):
+        return os.stat(dirpath).st_mtime_ns
+
+    def _row(self, dirpath):
+        try:
+            with self._lock:
+                row = self._connect().execute('SELECT mtime, has_dicom, info, leaf FROM series WHERE path=?',
+                                              (os.path.abspath(dirpath),)).fetchone()
+            if row is None or row[0] != self._mtime(dirpath):
+                return None
+            return row
+        except Exception as e:
+            print(e)
+            return None
+
+    def hasDicom(self, dirpath):
+        """True/False if the directory is known to (not) contain dicom files, None if unknown or stale"""
+        row = self._row(dirpath)
+        return None if row is None else bool(row[1])
+
+    def listing(self, dirpath):
+        """(has_dicom, leaf) recorded for the directory, leaf being True if it has no subdirectories, or None if
+        unknown or stale"""
+        row = self._row(dirpath)
+        if row is None or row[3] is None:
+            return None
+        return bool(row[1]), bool(row[3])
+
+    def lookup(self, dirpath):
+        """return the recorded series description for dirpath, or None if it must be scanned"""
+        row = self._row(dirpath)
+        if row is None or not row[2]:
+            return None
+        info = json.loads(row[2])
+        info['files'] = [os.path.join(dirpath, f) for f in info['files']]
+        info['shape'] = tuple(info['shape'])
+        info['affine'] = np.array(info['affine'], dtype=np.float32)
+        return info
+
+    def record(self, dirpath, has_dicom, series=None, mtime=None, commit=True, leaf=None):
+        """store a listing result (has_dicom, leaf) or full series description for dirpath
+
+        mtime should be taken before dirpath was read so that concurrent changes invalidate the entry
+        """
+        try:
+            if mtime is None:
+                mtime = self._mtime(dirpath)
+            info = None
+            if series is not None:
+                info = dict(series)
+                info['files'] = [os.path.relpath(f, dirpath) for f in series['files']]
+                info['shape'] = list(series['shape'])
+                info['affine'] = np.asarray(series['affine']).tolist()
+                info = json.dumps(info)
+            with self._lock:
+                db = self._connect()
+                if leaf is not None:
+                    leaf = int(bool(leaf))
+                # don't discard a previously scanned series when only the listing is refreshed (or the other way
+                # round) while the directory is unchanged
+                db.execute('INSERT INTO series (path, mtime, has_dicom, info, leaf) VALUES (?, ?, ?, ?, ?) '
+                           'ON CONFLICT(path) DO UPDATE SET has_dicom=excluded.has_dicom, '
+                           'info=COALESCE(excluded.info, CASE WHEN series.mtime=excluded.mtime THEN series.info END), '
+                           'leaf=COALESCE(excluded.leaf, CASE WHEN series.mtime=excluded.mtime THEN series.leaf END), '
+                           'mtime=excluded.mtime',
+                           (os.path.abspath(dirpath), mtime, int(bool(has_dicom)), info, leaf))
+                if commit:
+                    db.commit()
+        except Exception as e:
+            print(e)
+
+    def invalidate(self, dirpath):
+        with self._lock:
+            db = self._connect()
+            db.execute('DELETE FROM series WHERE path=?', (os.path.abspath(dirpath),))
+            db.commit()
+
+    def commit(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.commit()
+
+_dicom_index = None
+def getDicomIndex():
+    """index shared by all providers and the file browser"""
+    global _dicom_index
+    if _dicom_index is None:
+        _dicom_index = DicomSeriesIndex()
+    return _dicom_index
+
+class DirectoryScanner:
+    """streaming directory scanner built on os.scandir
+
+    yields batches of image paths (relative to root, prefixed with './') as they are found. Directories containing
+    dicom files are reported so the series can be opened as a whole; series directories without subdirectories
+    are not descended into, their slices are opened through the directory. Listings are remembered with the
+    directory's mtime (also across runs through dicom_index) so that rescanning the same tree only re-lists
+    directories that changed.
+    """
+    dicom_extensions = ['.dcm', '.dicom']
+
+    def __init__(self, exts, ignore_dirs=['.git'], dicom_index=None):
+        self.exts = set(str(x).lower() for x in exts)
+        self.ignore_dirs = set(ignore_dirs)
+        self.dicom_index = dicom_index
+        self._listings = {}
+
+    def _listDir(self, dirpath):
+        """return (files, subdirs) of dirpath, reusing the previous listing if the directory is unchanged"""
+        mtime = os.stat(dirpath).st_mtime_ns
+        cached = self._listings.get(dirpath, None)
+        if cached is not None and cached[0] == mtime:
+            return cached[1], cached[2]
+        files, subdirs = [], []
+        with os.scandir(dirpath) as it:
+            for entry in it:
+                try:
+                    if entry.is_dir(follow_symlinks=True):
+                        subdirs.append(entry.name)
+                    else:
+                        files.append(entry.name)
+                except OSError:
+                    continue
+        self._listings[dirpath] = (mtime, files, subdirs)
+        return files, subdirs
+
+    def _hasDicom(self, dirpath):
+        return self._dicomListing(dirpath)[0]
+
+    def _dicomListing(self, dirpath):
+        """(has_dicom, leaf) of a directory, from the index if it is unchanged since it was recorded"""
+        if self.dicom_index is not None:
+            listing = self.dicom_index.listing(dirpath)
+            if listing is not None:
+                return listing
+        mtime = os.stat(dirpath).st_mtime_ns
+        files, subdirs = self._listDir(dirpath)
+        has_dicom = any(os.path.splitext(f)[1] in self.dicom_extensions for f in files)
+        leaf = not any(d not in self.ignore_dirs for d in subdirs)
+        if self.dicom_index is not None:
+            self.dicom_index.record(dirpath, has_dicom, mtime=mtime, commit=False, leaf=leaf)
+        return has_dicom, leaf
+
+    def scan(self, root, recursive=True, cancel=None, batchsize=500):
+        """generator of lists of relative image paths under root. Stops early once cancel (threading.Event) is set"""
+        root = root.rstrip('/') or '/'
+        def relpath(p):
+            return './'+os.path.relpath(p, root)
+
+        batch = []
+        visited = set()
+        stack = [(root, 0)]
+        try:
+            while stack:
+                if cancel is not None and cancel.is_set():
+                    return
+                dirpath, depth = stack.pop()
+                realpath = os.path.realpath(dirpath)
+                if realpath in visited:
+                    continue # symlink loop
+                visited.add(realpath)
+                try:
+                    files, subdirs = self._listDir(dirpath)
+                except OSError as e:
+                    print(e)
+                    continue
+                for f in files:
+                    if os.path.splitext(f)[1].lower() in self.exts:
+                        batch.append(relpath(os.path.join(dirpath, f)))
+                for d in sorted(subdirs, reverse=True):
+                    if d in self.ignore_dirs:
+                        continue
+                    subpath = os.path.join(dirpath, d)
+                    try:
+                        has_dicom, leaf = self._dicomListing(subpath)
+                        if has_dicom:
+                            batch.append(relpath(subpath))
+                    except OSError as e:
+                        print(e)
+                        continue
+                    if recursive and not (has_dicom and leaf):
+                        stack.append((subpath, depth+1))
+                if len(batch) >= batchsize:
+                    yield batch
+                    batch = []
+            if batch:
+                yield batch
+        finally:
+            if self.dicom_index is not None:
+                self.dicom_index.commit()
+
+class LoadCancelled(Exception):
+    pass
+
+class LoadTask:
+    """handle for a volume load running on a worker thread
+
+    loaders report progress through update(), which also raises LoadCancelled once cancel() was called
+    """
+    def __init__(self, filepath, callback=None):
+        self.filepath = filepath
+        self.callback = callback
+        self.future = None
+        self._cancelled = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def done(self):
+        return self.future is not None and self.future.done()
+
+    def update(self, done, total, units='slices'):
+        if self._cancelled.is_set():
+            raise LoadCancelled('Loading of "{!s}" was cancelled'.format(self.filepath))
+        if self.callback is not None:
+            self.callback(done, total, units)
+
 class BaseDataProvider:
     __metaclass__ = ABCMeta
-    def __init__(self):
+    def __init__(self, cache_bytes=2*1024**3):
         self.__cachedimage__ = None
         self.__cachedimagepath__ = None
+        self._cached_meta = {}
+        self.cache = VolumeCache(cache_bytes)
+        # volume statistics are computed by the loader (on its worker thread) with stats_on_load, otherwise on the
+        # first getVolumeStats() call or in the background with prepareStats()
+        self.stats_on_load = False
+        self._stats_pending = {}
+        # non-axial views of volumes larger than reorient_min_bytes are served from a copy with the viewed
+        # axis made contiguous, built in the background. With reorient_on_disk the copy is a memmapped
+        # temporary file (in reorient_dir) so it doesn't count against RAM. Copies larger than
+        # reorient_max_fraction of the cache budget always go to disk
+        self.reorient_min_bytes = 32*1024**2
+        self.reorient_max_fraction = 0.5
+        self.reorient_on_disk = False
+        self.reorient_dir = None
+        self._reorient_pending = {}
+        self._fullread_pending = {}
+        # with background_decode (set by the viewer), slices that need the whole volume read first (e.g. coronal
+        # views of a dicom series) aren't read on the calling thread: the read is started on a worker thread
+        # (see prepareFullRead) and None is returned until it has finished
+        self.background_decode = False
+        self.pyramid_max_slices = 256
+        # projections/thick slabs combine per-block reductions (cached per frame, orientation and mode) with the
+        # few slices at either end of the slab, so moving a slab reuses most of the work
+        self.projection_block = 8
+        self.projection_max_slabs = 64
+        self.reslicer = ObliqueReslicer()
+        # optional reduced precision for display-only sessions (e.g. 'float32' or 'float16'). In-memory float
+        # volumes of higher precision are converted at load, lazily read volumes are converted per slice
+        self.downcast = None
+        self._executors = {}
+        self._pending = {}
+        self._pending_lock = threading.Lock()
 
     def __checkCached__(self, filepath):
         if (self.__cachedimage__ is not None and filepath == self.__cachedimagepath__):
             return True
+        entry = self.cache.get(filepath)
+        if entry is not None:
+            self.__cachedimage__ = entry['volume']
+            self.__cachedimagepath__ = filepath
+            self._setVolumeMeta(entry['meta'])
+            return True
         else: return False
 
     @abstractmethod
-    def __fileLoader__(self, filepath):
+    def __fileLoader__(self, filepath, size=None, meta=None, progress=None):
+        """load volume from filepath, recording size/affine/etc. in the meta dict
+
+        must not modify provider state since it may be run from a worker thread. Long running loaders
+        should report through progress.update() so that the load can be cancelled
+        """
         return
 
+    def _setVolumeMeta(self, meta):
+        """restore metadata of the active volume from a cache entry"""
+        self._cached_meta = meta
+
+    def getVolumeStats(self, filepath, size=None):
+        """intensity statistics (min/max/percentiles/histogram) of the whole volume, computed once and cached with it"""
+        if not self.__loadFile__(filepath, size=size):
+            return None
+        cached, key, vol = self._statsEntry(self.__cachedimage__, self._cached_meta)
+        stats = cached.get(key, None)
+        if stats is None:
+            stats = computeVolumeStats(vol)
+            cached[key] = stats
+        return stats
+
+    @staticmethod
+    def _statsEntry(vol, meta):
+        """(dict, key) the statistics of the viewed volume are cached in, and the volume to compute them from"""
+        if vol.nframes > 1:
+            # time series: statistics of the selected frame
+            return meta.setdefault('frame_stats', {}), vol.frame, vol.frameView(vol.frame)
+        return meta, 'stats', vol
+
+    def prepareStats(self, filepath, size=None):
+        """start computing the statistics returned by getVolumeStats() on a worker thread
+
+        returns the future of the background job, or None if they are known already (or the file isn't loaded)
+        """
+        if not self.isLoaded(filepath) or not self.__loadFile__(filepath, size=size):
+            return None
+        cached, key, vol = self._statsEntry(self.__cachedimage__, self._cached_meta)
+        if cached.get(key, None) is not None:
+            return None
+        with self._pending_lock:
+            future = self._stats_pending.get((filepath, key), None)
+            if future is None:
+                future = self._getExecutor('stats', max_workers=1).submit(self._statsWorker, filepath, vol, cached, key)
+                self._stats_pending[(filepath, key)] = future
+        return future
+
+    def _statsWorker(self, filepath, vol, cached, key):
+        try:
+            stats = computeVolumeStats(vol)
+            cached[key] = stats
+            # statistics of a dicom series are computed from the whole decoded series
+            self._accountFullRead(filepath, vol)
+            return stats
+        except Exception as e:
+            print(e)
+            return None
+        finally:
+            with self._pending_lock:
+                self._stats_pending.pop((filepath, key), None)
+
+    def getCacheStats(self):
+        return self.cache.stats()
+
+    def resetCache(self, filepath=None):
+        """drop the active volume (or filepath) from the cache, forcing a reload from disk on next access"""
+        if filepath is None:
+            filepath = self.__cachedimagepath__
+        if filepath is not None:
+            self.cache.invalidate(filepath)
+        if filepath == self.__cachedimagepath__:
+            self.__cachedimage__ = None
+            self.__cachedimagepath__ = None
+            self._setVolumeMeta({})
+
     def load(self, filepath, size=None):
         if (self.__loadFile__(filepath, size)):
             return self.__cachedimage__
@@ -198,60 +1842,541 @@ class BaseDataProvider:
                     # [re]load data volume from file
                     if not os.path.exists(filepath):
                         raise FileNotFoundError
-                    del self.__cachedimage__
-                    self.__cachedimage__ = self.__fileLoader__(filepath, size)
-                    if self.__cachedimage__ is not None:
+                    self.__cachedimage__ = None
+                    self.__cachedimagepath__ = None
+                    self._setVolumeMeta({})
+                    with self._pending_lock:
+                        task = self._pending.get(filepath, None)
+                    entry = None
+                    if task is not None:
+                        # load is already in flight, only wait for it to finish
+                        entry = task.future.result()
+                    if entry is None and (task is None or task.cancelled):
+                        entry = self._loadVolume(filepath, size)
+                    if entry is not None:
                         status = True
+                        self.__cachedimage__ = entry['volume']
                         self.__cachedimagepath__ = filepath
+                        self._setVolumeMeta(entry['meta'])
         except Exception as e:
             print(e)
             status = False
         return status
 
+    def isLoaded(self, filepath):
+        """True if filepath can be displayed without reading it from disk"""
+        return bool(filepath) and self.__checkCached__(filepath)
+
+    def _loadVolume(self, filepath, size=None, progress=None):
+        """load filepath into the cache without changing the active volume. returns the cache entry"""
+        if progress is None:
+            progress = LoadTask(filepath)
+        meta = {}
+        vol = self.__fileLoader__(filepath, size, meta, progress)
+        if vol is None:
+            return None
+        vol = asVolume(vol, meta.get('affine', None))
+        meta['affine'] = vol.affine
+        if self.downcast is not None:
+            vol = downcastVolume(vol, self.downcast)
+        if self.stats_on_load:
+            cached, key, source = self._statsEntry(vol, meta)
+            cached[key] = computeVolumeStats(source)
+        return self.cache.put(filepath, vol, meta)
+
+    def _getExecutor(self, name, max_workers=2):
+        if name not in self._executors:
+            self._executors[name] = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='pyviz-{!s}'.format(name))
+        return self._executors[name]
+
+    def _submitLoad(self, executor, filepath, size=None, callback=None):
+        with self._pending_lock:
+            task = self._pending.get(filepath, None)
+            if task is not None and not task.cancelled:
+                if callback is not None:
+                    task.callback = callback
+                return task
+            task = LoadTask(filepath, callback)
+            self._pending[filepath] = task
+            task.future = executor.submit(self._loadWorker, task, size)
+            return task
+
+    def _loadWorker(self, task, size):
+        try:
+            return self._loadVolume(task.filepath, size, task)
+        except LoadCancelled:
+            return None
+        except Exception as e:
+            print(e)
+            return None
+        finally:
+            with self._pending_lock:
+                if self._pending.get(task.filepath, None) is task:
+                    del self._pending[task.filepath]
+
+    def loadAsync(self, filepath, size=None, callback=None):
+        """load filepath into the cache on a worker thread and return its LoadTask
+
+        callback(done, total, units) is called from the worker thread as the load progresses.
+        task.future resolves to the cache entry, or None if loading failed or was cancelled
+        """
+        return self._submitLoad(self._getExecutor('load'), filepath, size, callback)
+
+    def prefetch(self, filepaths, size=None):
+        """load volumes into the cache in background threads so later selection doesn't block"""
+        for filepath in filepaths:
+            if not filepath or filepath == self.__cachedimagepath__ or filepath in self.cache:
+                continue
+            self._submitLoad(self._getExecutor('prefetch'), filepath, size)
+
+    def prepareOrientation(self, filepath, orientation, size=None):
+        """start building a copy of the volume with slices along orientation contiguous in memory (or on disk)
+
+        coronal/sagittal slices of a C-ordered volume are strided views that touch a cache line (or page, if
+        memmapped) per voxel. Returns the future of the background job, or None if no copy is needed
+        """
+        if orientation == 0 or not self.__loadFile__(filepath, size=size):
+            return None
+        vol = self.__cachedimage__
+        meta = self._cached_meta
+        if vol.needsFullRead(orientation):
+            # read in memory once the full read is done, no copy is needed
+            task = self.prepareFullRead(filepath, size=size)
+            return task.future if task is not None else None
+        if vol.nframes > 1:
+            # time series frames are read on demand, copying a frame would read all of it
+            return None
+        if orientation in meta.get('reoriented', {}) or vol.size*vol.dtype.itemsize < self.reorient_min_bytes:
+            return None
+        key = (filepath, orientation)
+        with self._pending_lock:
+            future = self._reorient_pending.get(key, None)
+            if future is None:
+                future = self._getExecutor('reorient', max_workers=1).submit(self._reorientWorker, filepath, vol, meta, orientation)
+                self._reorient_pending[key] = future
+        return future
+
+    def prepareFullRead(self, filepath, size=None, callback=None):
+        """start reading all of a volume whose non-axial slices need it (dicom series) on a worker thread
+
+        returns the LoadTask of the read, reporting progress to callback(done, total, units) and cancellable, or
+        None if the volume can already serve every slice or is not loaded yet
+        """
+        if not self.isLoaded(filepath) or not self.__loadFile__(filepath, size=size):
+            return None
+        vol = self.__cachedimage__
+        if not vol.needsFullRead(1) and not vol.needsFullRead(2):
+            return None
+        with self._pending_lock:
+            task = self._fullread_pending.get(filepath, None)
+            if task is not None and not task.cancelled:
+                if callback is not None:
+                    task.callback = callback
+                return task
+            task = LoadTask(filepath, callback)
+            self._fullread_pending[filepath] = task
+            task.future = self._getExecutor('reorient', max_workers=1).submit(self._fullReadWorker, task, vol)
+            return task
+
+    def _fullReadWorker(self, task, vol):
+        try:
+            vol.readAll(task)
+            self._accountFullRead(task.filepath, vol)
+            return vol
+        except LoadCancelled:
+            return None
+        except Exception as e:
+            print(e)
+            return None
+        finally:
+            with self._pending_lock:
+                if self._fullread_pending.get(task.filepath, None) is task:
+                    del self._fullread_pending[task.filepath]
+
+    def _accountFullRead(self, filepath, vol):
+        # the cache was charged with the lazily read size
+        entry = self.cache.peek(filepath)
+        if entry is not None and entry['volume'] is vol and vol.nbytes > entry['nbytes']:
+            self.cache.account(filepath, vol.nbytes-entry['nbytes'])
+
+    def _deferFullRead(self, filepath, vol, axes, size=None):
+        """True if reading along axes has to wait for a background full read, which is started if needed"""
+        if not self.background_decode or not any(vol.needsFullRead(axis) for axis in axes):
+            return False
+        self.prepareFullRead(filepath, size=size)
+        return True
+
+    def _reorientWorker(self, filepath, vol, meta, orientation):
+        try:
+            shape = (vol.shape[orientation],) + tuple(x for ii, x in enumerate(vol.shape) if ii != orientation)
+            # the size of the data, vol.nbytes is what memmapped/lazy volumes hold in memory
+            on_disk = self.reorient_on_disk or vol.size*vol.dtype.itemsize > self.cache.max_bytes*self.reorient_max_fraction
+            if on_disk:
+                # anonymous temporary file, removed by the OS once the mapping is released
+                out = np.memmap(tempfile.TemporaryFile(dir=self.reorient_dir), dtype=vol.dtype, mode='w+', shape=shape)
+            else:
+                out = np.empty(shape, dtype=vol.dtype)
+            reorientVolume(vol, orientation, out=out)
+            meta.setdefault('reoriented', {})[orientation] = out
+            if not on_disk:
+                self.cache.account(filepath, out.nbytes)
+            return out
+        except Exception as e:
+            print(e)
+            return None
+        finally:
+            with self._pending_lock:
+                self._reorient_pending.pop((filepath, orientation), None)
+
     def getImageSlice(self, filepath, slicenum, orientation=0, size=None):
+        with getPerfStats().timer('slice', orientation=orientation):
+            return self._getImageSlice(filepath, slicenum, orientation, size)
+
+    def _getImageSlice(self, filepath, slicenum, orientation=0, size=None):
         try:
             if self.__loadFile__(filepath, size=size):
                 if self.__cachedimage__ is not None:
-                    if orientation==0:
-                        slice = self.__cachedimage__[slicenum, :, :]
-                    elif orientation==1:
-                        slice = self.__cachedimage__[:, slicenum, :]
+                    reoriented = self._cached_meta.get('reoriented', {}).get(orientation, None)
+                    if reoriented is None and self._deferFullRead(filepath, self.__cachedimage__, [orientation], size):
+                        return None
+                    if reoriented is not None:
+                        slice = reoriented[slicenum]
                     else:
-                        slice = np.fliplr(self.__cachedimage__[:, :, slicenum])
+                        slice = self.__cachedimage__.getSlice(orientation, slicenum)
+                    if orientation==2:
+                        slice = np.fliplr(slice)
+                    if self.downcast is not None and needsDowncast(slice.dtype, self.downcast):
+                        slice = slice.astype(self.downcast)
                     return slice
         except Exception as e:
             print(e)
 
+    def getImageSliceLevel(self, filepath, slicenum, orientation=0, level=0, size=None):
+        """slice downsampled by 2**level in-plane, from a per-slice pyramid built lazily and cached with the volume
+
+        each level is computed from the next finer one, so stepping out through zoom levels reuses earlier work
+        """
+        if level <= 0:
+            return self.getImageSlice(filepath, slicenum, orientation, size=size)
+        if not self.__loadFile__(filepath, size=size):
+            return None
+        pyramid = self._cached_meta.setdefault('pyramid', OrderedDict())
+        key = (self.__cachedimage__.frame, orientation, slicenum, level)
+        arr = pyramid.get(key, None)
+        if arr is not None:
+            pyramid.move_to_end(key)
+            return arr
+        finer = self.getImageSliceLevel(filepath, slicenum, orientation, level-1, size=size)
+        if finer is None:
+            return None
+        arr = downsample2x(finer)
+        pyramid[key] = arr
+        while len(pyramid) > self.pyramid_max_slices:
+            pyramid.popitem(last=False)
+        return arr
+
+    def getProjection(self, filepath, mode='max', orientation=0, start=None, stop=None, size=None):
+        """maximum, minimum or mean intensity projection of slices [start, stop) along orientation
+
+        without start/stop the whole volume is projected; a range gives a thick slab. The result is oriented like
+        getImageSlice
+        """
+        with getPerfStats().timer('projection', mode=mode, orientation=orientation):
+            return self._getProjection(filepath, mode, orientation, start, stop, size)
+
+    def _getProjection(self, filepath, mode, orientation, start, stop, size):
+        try:
+            if not self.__loadFile__(filepath, size=size):
+                return None
+            vol = self.__cachedimage__
+            meta = self._cached_meta
+            # projections read the whole slab, a dicom series is decoded once for them
+            if self._deferFullRead(filepath, vol, [1, 2], size):
+                return None
+            start, stop, _ = slice(start, stop).indices(vol.shape[orientation])
+            if stop <= start:
+                return None
+            slabs = meta.setdefault('slabs', OrderedDict())
+            key = (vol.frame, orientation, mode, start, stop)
+            arr = slabs.get(key, None)
+            if arr is not None:
+                slabs.move_to_end(key)
+                return arr
+            ufunc, dtype = _projectionUfunc(mode, vol.dtype)
+            block = self.projection_block
+            first, last = -(-start//block), stop//block
+            parts = []
+            if first < last:
+                blocks = self._getProjectionBlocks(filepath, vol, meta, orientation, mode)
+                parts.append(ufunc.reduce(blocks[first:last], axis=0, dtype=dtype))
+                ends = list(range(start, first*block)) + list(range(last*block, stop))
+            else:
+                ends = range(start, stop)
+            reoriented = meta.get('reoriented', {}).get(orientation, None)
+            for ii in ends:
+                parts.append(reoriented[ii] if reoriented is not None else vol.getSlice(orientation, ii))
+            arr = ufunc.reduce(np.stack(parts), axis=0, dtype=dtype)
+            if mode == 'mean':
+                arr = arr/np.asarray(stop-start, dtype=arr.dtype)
+            if orientation==2:
+                arr = np.fliplr(arr)
+            if self.downcast is not None and needsDowncast(arr.dtype, self.downcast):
+                arr = arr.astype(self.downcast)
+            slabs[key] = arr
+            # charged to the volume's cache entry like the other data derived from it
+            charged = arr.nbytes
+            while len(slabs) > self.projection_max_slabs:
+                charged -= slabs.popitem(last=False)[1].nbytes
+            self.cache.account(filepath, charged)
+            return arr
+        except Exception as e:
+            print(e)
+
+    def _getProjectionBlocks(self, filepath, vol, meta, orientation, mode):
+        projections = meta.setdefault('projections', {})
+        key = (vol.frame, orientation, mode)
+        blocks = projections.get(key, None)
+        if blocks is None:
+            vol.readAll()
+            blocks = blockReduce(vol, orientation, mode, block=self.projection_block,
+                                 executor=self._getExecutor('project', max_workers=os.cpu_count() or 1))
+            projections[key] = blocks
+            self.cache.account(filepath, blocks.nbytes)
+        return blocks
+
+    def getObliqueSlice(self, filepath, slicenum, orientation=0, tilt=(0.0, 0.0), size=None):
+        """plane slicenum of the orientation tilted by (a, b) degrees, resampled to isotropic physical spacing
+
+        planes are numbered along the tilted normal (see getObliqueSliceCount); the image is oriented like
+        getImageSlice and is NaN outside the volume
+        """
+        with getPerfStats().timer('oblique', orientation=orientation):
+            try:
+                if self.__loadFile__(filepath, size=size):
+                    vol = self.__cachedimage__
+                    # planes cross many slices: read the whole volume first rather than the files of each plane
+                    if self._deferFullRead(filepath, vol, [1, 2], size):
+                        return None
+                    vol.readAll()
+                    slice = self.reslicer.getSlice(vol, orientation, slicenum, tilt)
+                    if orientation==2:
+                        slice = np.fliplr(slice)
+                    return slice
+            except Exception as e:
+                print(e)
+
+    def getObliqueSliceCount(self, filepath, orientation=0, tilt=(0.0, 0.0), size=None):
+        if self.__loadFile__(filepath, size=size):
+            return self.reslicer.sliceCount(self.__cachedimage__, orientation, tilt)
+        else: return 0
+
     def getSliceCount(self, filepath, orientation=0, size=None):
         if self.__loadFile__(filepath, size=size):
             return self.__cachedimage__.shape[orientation]
         else: return 0
 
+    def getFrameCount(self, filepath, size=None):
+        """number of frames of a time series (4d) volume, 1 for 3d volumes"""
+        if self.__loadFile__(filepath, size=size):
+            return self.__cachedimage__.nframes
+        else: return 0
+
+    def getFrame(self, filepath, size=None):
+        if self.__loadFile__(filepath, size=size):
+            return self.__cachedimage__.frame
+        else: return 0
+
+    def setFrame(self, filepath, frame, size=None):
+        """select the frame of a time series volume that slices and statistics are taken from"""
+        try:
+            if self.__loadFile__(filepath, size=size):
+                self.__cachedimage__.setFrame(frame)
+                return True
+        except Exception as e:
+            print(e)
+        return False
+
+    def refresh(self, filepath=None):
+        """check a cached file for changes since it was loaded (e.g. a growing output file)
+
+        volumes that can extend themselves (appended hdf5 slices/frames, raw time series) only pick up the new
+        data and keep their cached slices; other changed files are dropped from the cache to be reloaded on next
+        access. Returns True if the file changed
+        """
+        if filepath is None:
+            filepath = self.__cachedimagepath__
+        entry = self.cache.peek(filepath)
+        if entry is None or entry['stamp'] == self.cache._stamp(filepath):
+            return False
+        vol = entry['volume']
+        nframes = vol.nframes
+        refreshed = vol.refresh()
+        if not refreshed:
+            self.resetCache(filepath)
+            return True
+        if isinstance(refreshed, BaseVolume):
+            vol = refreshed
+            if filepath == self.__cachedimagepath__:
+                self.__cachedimage__ = vol
+        meta = entry['meta']
+        # derived data no longer covers the volume; statistics of frames complete before the refresh still hold
+        for key in ('stats', 'pyramid', 'reoriented', 'projections', 'slabs'):
+            meta.pop(key, None)
+        frame_stats = meta.get('frame_stats', {})
+        for frame in [x for x in frame_stats if x >= nframes-1]:
+            del frame_stats[frame]
+        meta['size'] = vol.shape[::-1]
+        entry = self.cache.put(filepath, vol, meta)
+        if filepath == self.__cachedimagepath__:
+            self._setVolumeMeta(entry['meta'])
+        return True
+
 class ImageDataProvider(BaseDataProvider):
     image_extensions = ['.png', '.jpg', '.jpeg', '.bmp']
     dicom_extensions = ['.dcm', '.dicom']
 
-    def __init__(self):
-        super().__init__()
+    def __init__(self, cache_bytes=2*1024**3, use_dicom_index=True):
+        super().__init__(cache_bytes)
+        self.use_dicom_index = use_dicom_index
         self.valid_exts = set()
         self.loaders = []
-        self._addLoader(self._loadFromMat, ['.mat'])
-        self._addLoader(self._loadFromLegacyDoseMat, ['.mat'])
-        self._addLoader(self._loadFromNpy, ['.npy', '.npz'])
-        self._addLoader(self._loadFromH5, ['.h5', '.hdf5', '.dose', '.fmap'])
-        self._addLoader(self._loadFromDicom, ['']+self.dicom_extensions)
-        self._addLoader(self._loadFromBinWithSize, ['', '.bin', '.raw'])
-        self._addLoader(self._loadFromCTIBin, ['.cti', '.ctislice', '.seg'])
-        self._addLoader(self._loadFromBin, ['', '.bin', '.raw'])
-
-        self._cached_size = None
+        # registry order matters: the first loader whose sniffer accepts the file is the only one called
+        self._addLoader(self._loadFromMat, ['.mat'], sniff=self._sniffMatradMat, magic=True, list=listMatArrays)
+        self._addLoader(self._loadFromLegacyDoseMat, ['.mat'], sniff=self._sniffMat, magic=True, list=listMatArrays)
+        self._addLoader(self._loadFromNpy, ['.npy', '.npz'], sniff=self._sniffNpy, magic=True, list=listNpzArrays)
+        self._addLoader(self._loadFromH5, ['.h5', '.hdf5', '.dose', '.fmap'], sniff=self._sniffH5, magic=True, list=listH5Arrays)
+        self._addLoader(self._loadFromDicom, ['']+self.dicom_extensions, sniff=self._sniffDicom, magic=True)
+        self._addLoader(self._loadFromBinWithSize, ['', '.bin', '.raw'], sniff=self._sniffBinWithSize)
+        self._addLoader(self._loadFromCTIBin, ['.cti', '.ctislice', '.seg'], sniff=self._sniffCTIBin)
+        self._addLoader(self._loadFromBin, ['', '.bin', '.raw'], sniff=self._sniffBin)
+
+        # detected loader (or None on failed detection) per (path, size), invalidated when the file changes
+        self._detected = {}
+        self._detected_lock = threading.Lock()
+        # array shown from container files (npz, hdf5, mat) that hold several, by path. Default: loader's choice
+        self.selected_arrays = {}
+
+        self._cachedsize = None
         self._cached_affine_matrix = None
 
-    def _addLoader(self, callable, valid_exts=[]):
-        self.loaders.append({"callable": callable, "valid_exts": [str(x).lower() for x in valid_exts]})
+    def _addLoader(self, callable, valid_exts=[], sniff=None, magic=False, list=None):
+        """register a loader for files with the given extensions
+
+        sniff(filepath, header, size) decides from a peek at the first bytes of the file (and its size) whether
+        the loader can open it. Loaders identified by magic bytes are also tried for files with other extensions.
+        For container formats, list(filepath) returns the (name, shape, dtype) of the arrays the loader can be
+        asked to open (through meta['array']) without reading them
+        """
+        self.loaders.append({"callable": callable, "valid_exts": [str(x).lower() for x in valid_exts],
+                             "sniff": sniff, "magic": magic, "list": list})
         for ext in valid_exts:
             self.valid_exts.add(ext)
 
+    header_peek_bytes = 1032 # covers the dicom preamble and an hdf5 superblock at offset 512 (matlab v7.3)
+
+    @staticmethod
+    def _isH5Header(header):
+        return any(header[off:off+8] == b'\x89HDF\r\n\x1a\n' for off in (0, 512, 1024))
+
+    def _sniffMat(self, filepath, header, size):
+        # v7.3 files are hdf5 files with a matlab text header, left to the hdf5 loader
+        return header[:6] == b'MATLAB' and not self._isH5Header(header)
+
+    def _sniffMatradMat(self, filepath, header, size):
+        # v5 files list their variables from headers alone; matrad files hold a "ct" struct
+        if not self._sniffMat(filepath, header, size):
+            return False
+        from scipy.io import whosmat
+        return 'ct' in [name for name, shape, cls in whosmat(filepath)]
+
+    def _sniffNpy(self, filepath, header, size):
+        return header[:6] == b'\x93NUMPY' or header[:4] == b'PK\x03\x04'
+
+    def _sniffH5(self, filepath, header, size):
+        return self._isH5Header(header)
+
+    def _sniffDicom(self, filepath, header, size):
+        if os.path.isdir(filepath):
+            return True
+        # the preamble is optional in some writers, fall back to the extension
+        return header[128:132] == b'DICM' or os.path.splitext(filepath)[1].lower() in self.dicom_extensions
+
+    def _sniffBinWithSize(self, filepath, header, size):
+        headersize = struct.calcsize('I'*3)
+        if len(header) < headersize:
+            return False
+        nvoxels = int(np.prod(struct.unpack('I'*3, header[:headersize]), dtype=np.int64))
+        return os.path.getsize(filepath) == headersize + nvoxels*np.dtype('f').itemsize
+
+    def _sniffCTIBin(self, filepath, header, size):
+        return size is not None and os.path.getsize(filepath) == int(np.prod(size))*np.dtype('h').itemsize
+
+    def _sniffBin(self, filepath, header, size):
+        # anything holding at least one float volume, larger files are read as a (growing) series of volumes.
+        # Partially written volumes (fewer bytes than one volume) are not supported, there is no header to tell
+        # them apart from a wrong size
+        return size is not None and os.path.getsize(filepath) >= int(np.prod(size))*np.dtype('f').itemsize
+
+    def detectFormat(self, filepath, size=None):
+        """return the registered loader entry able to open filepath, or None if no format matched
+
+        results are cached per path/size until the file changes, so repeated opens skip detection
+        """
+        key = (filepath, tuple(size) if size is not None else None)
+        stamp = fileStamp(filepath)
+        with self._detected_lock:
+            cached = self._detected.get(key, None)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+        loader = self._sniffFormat(filepath, size)
+        with self._detected_lock:
+            self._detected[key] = (stamp, loader)
+        return loader
+
+    def _sniffFormat(self, filepath, size=None):
+        header = b''
+        if not os.path.isdir(filepath):
+            with open(filepath, 'rb') as fd:
+                header = fd.read(self.header_peek_bytes)
+        ext = os.path.splitext(filepath)[1].lower()
+        # loaders registered for the extension first, then anything recognizable by its magic bytes
+        candidates = [l for l in self.loaders if ext in l['valid_exts']]
+        candidates += [l for l in self.loaders if l['magic'] and l not in candidates]
+        for loader in candidates:
+            try:
+                if loader['sniff'] is None or loader['sniff'](filepath, header, size):
+                    return loader
+            except Exception:
+                continue
+        return None
+
+    def listArrays(self, filepath, size=None):
+        """(name, shape, dtype) of the arrays held by a container file (npz, hdf5, mat), read from headers only
+
+        returns an empty list for files holding a single volume
+        """
+        try:
+            loader = self.detectFormat(filepath, size)
+            if loader is None or loader['list'] is None or os.path.isdir(filepath):
+                return []
+            return loader['list'](filepath)
+        except Exception as e:
+            print(e)
+            return []
+
+    def selectArray(self, filepath, name):
+        """show array name (None: the loader's default) of a container file, dropping a different array from the cache"""
+        if self.selected_arrays.get(filepath, None) == name:
+            return
+        if name is None:
+            self.selected_arrays.pop(filepath, None)
+        else:
+            self.selected_arrays[filepath] = name
+        self.resetCache(filepath)
+
+    def getSelectedArray(self, filepath):
+        return self.selected_arrays.get(filepath, None)
+
     def getSize(self):
         return self._cachedsize
 
@@ -271,118 +2396,424 @@ class ImageDataProvider(BaseDataProvider):
     def getValidExtensions(self):
         return list(self.valid_exts)
 
-    def resetCache(self):
-        self.__cachedimage__ = None
-        self.__cachedimagepath__ = None
-        self._cachedsize = None
-        self._cached_affine_matrix = None
+    def _setVolumeMeta(self, meta):
+        super()._setVolumeMeta(meta)
+        self._cachedsize = meta.get('size', None)
+        self._cached_affine_matrix = meta.get('affine', None)
+
+    def _memmapVolume(self, filepath, dtype, size, offset=0):
+        """map a linearly packed (C-major) volume from disk without reading it into memory
+
+        data is paged in by the OS as slices are indexed, and the on-disk dtype is preserved
+        """
+        dtype = np.dtype(dtype)
+        shape = tuple(int(x) for x in size[::-1])
+        expected = offset + int(np.prod(shape))*dtype.itemsize
+        actual = os.path.getsize(filepath)
+        if actual != expected:
+            raise ValueError("file size ({:d} bytes) doesn't match array of size {!s} and type \"{!s}\" ({:d} bytes)".format(
+                actual, tuple(size), dtype, expected))
+        return np.memmap(filepath, dtype=dtype, mode='r', offset=offset, shape=shape)
 
     def _loadFromBinWithSize(self, filepath, *args, **kwargs):
+        headersize = struct.calcsize('I'*3)
         with open(filepath, 'rb') as fd:
-            sizebuf = fd.read(struct.calcsize('I'*3))
-            databuf = fd.read()
+            sizebuf = fd.read(headersize)
         size = np.array(struct.unpack('I'*3, sizebuf))
-        arr = np.array(struct.unpack('f'*np.product(size), databuf)).reshape(size[::-1])
+        arr = self._memmapVolume(filepath, 'f', size, offset=headersize)
         #  arr = np.transpose(arr, [0, 2, 1])
         return arr
 
     def _loadFromBin(self, filepath, size, *args, **kwargs):
         if size is None:
             raise ValueError("size must be 3-tuple")
-        with open(filepath, 'rb') as fd:
-            buf = fd.read()
-        except_msgs = []
+        # infer float/double from the file size instead of attempting to unpack as each type
+        nbytes = os.path.getsize(filepath)
+        nvoxels = int(np.prod(size))
         for type in ['f', 'd']:
-            try:
-                arr = np.array(struct.unpack(type*np.product(size), buf)).reshape(size[::-1])
+            if type == 'd' and nbytes == nvoxels*np.dtype(type).itemsize and self._isFloatPairs(filepath):
+                # exactly two float volumes are as large as one double volume
                 break
-            except Exception as e:
-                except_msgs.append(str(e))
-                continue
-        if arr is None:
-            raise Exception("\n".join(except_msgs))
-        return arr
+            if nbytes == nvoxels*np.dtype(type).itemsize:
+                # a watched file may grow into a series of volumes of this type, see _memmapFrames
+                return ArrayVolume(self._memmapVolume(filepath, type, size),
+                                   reopen=lambda type=type: self._memmapFrames(filepath, type, size))
+        if nbytes < nvoxels*np.dtype('f').itemsize:
+            raise ValueError("file size ({:d} bytes) doesn't match float or double array of size {!s}".format(nbytes, tuple(size)))
+        # float volumes appended one after the other (e.g. by a running job). Complete frames are mapped,
+        # and mapped again by refresh() as the file grows
+        remap = lambda: self._memmapFrames(filepath, 'f', size)
+        return TimeSeriesVolume(remap(), reopen=remap)
+
+    @staticmethod
+    def _isFloatPairs(filepath, max_samples=4096):
+        """guess whether a file sized for double values holds pairs of floats instead, from a sample of its words
+
+        neighbouring float values have similar exponents, while the low word of a double is the end of its
+        mantissa (random bits, or zeros for round values), whose bits in the float exponent position vary freely
+        """
+        words = np.memmap(filepath, dtype=np.uint32, mode='r')
+        pairs = words[:words.size//2*2].reshape(-1, 2)
+        pairs = np.array(pairs[::max(1, pairs.shape[0]//max_samples)])
+        # zeros in either word say nothing (zero floats, or round doubles)
+        pairs = pairs[(pairs & 0x7fffffff).all(axis=1)]
+        if pairs.shape[0] == 0:
+            return False
+        exponents = ((pairs >> 23) & 0xff).astype(np.int32)
+        # about 64 for the random low words of doubles
+        return np.median(np.abs(exponents[:, 0]-exponents[:, 1])) <= 16
+
+    def _memmapFrames(self, filepath, dtype, size, offset=0):
+        """map the complete volumes of size (x, y, z) stored back to back in filepath as a (t, z, y, x) array"""
+        dtype = np.dtype(dtype)
+        shape = tuple(int(x) for x in size[::-1])
+        framebytes = int(np.prod(shape))*dtype.itemsize
+        nframes = (os.path.getsize(filepath)-offset)//framebytes
+        if nframes < 1:
+            raise ValueError('"{!s}" holds no complete volume of size {!s}'.format(filepath, tuple(size)))
+        return np.memmap(filepath, dtype=dtype, mode='r', offset=offset, shape=(nframes,)+shape)
 
     def _loadFromCTIBin(self, filepath, size, *args, **kwargs):
         if size is None:
             raise ValueError("size must be 3-tuple")
-        with open(filepath, 'rb') as fd:
-            buf = fd.read()
-        arr = np.array(struct.unpack('h'*np.product(size), buf)).reshape(size[::-1])
+        arr = self._memmapVolume(filepath, 'h', size)
         arr = np.transpose(arr, [0, 2, 1])
         return arr
 
-    def _loadFromH5(self, filepath, *args, **kwargs):
-        with h5py.File(filepath, 'r') as fd:
-            excepts = []
-            for k in ["data", "volume", "arraydata"]:
-                try:
-                    return fd[k][:]
-                except Exception as e:
-                    excepts.append(e)
-                    continue
-            raise Exception('\n'.join(excepts))
+    def _loadFromH5(self, filepath, *args, meta=None, **kwargs):
+        # slices are read on demand from the open file rather than loading the full dataset
+        excepts = []
+        keys = ["data", "volume", "arraydata"]
+        if meta and meta.get('array', None) is not None:
+            keys = [meta['array']]
+        else:
+            # otherwise the first dataset that is a volume
+            keys += [name for name, shape, dtype in listH5Arrays(filepath) if len(shape) in (3, 4) and name not in keys]
+        for k in keys:
+            try:
+                vol = H5Volume(filepath, k)
+            except Exception as e:
+                excepts.append(str(e))
+                continue
+            if vol.ndim == 4:
+                # (t, z, y, x) series, frames are read from the dataset as they are viewed
+                return TimeSeriesVolume(vol.dataset, reopen=vol.reopen, close=vol.close)
+            return vol
+        raise Exception('\n'.join(excepts))
 
-    def _loadFromMat(self, filepath, *args, **kwargs):
-        # Load from matlab (matrad "cube")
-        d = loadmat(filepath)
+    def _loadFromMat(self, filepath, *args, meta=None, **kwargs):
+        if meta and meta.get('array', None) not in (None, 'ct'):
+            return self._loadMatVariable(filepath, meta['array'])
+        # Load from matlab (matrad "cube"), decoding only the ct struct
+        from scipy.io import loadmat
+        d = loadmat(filepath, variable_names=['ct'])
         return d['ct']['cube'][0,0][0,0].transpose((2,0,1))
 
-    def _loadFromLegacyDoseMat(self, filepath, *args, **kwargs):
+    def _loadMatVariable(self, filepath, name):
+        """a single numeric variable of a matlab v5 file, (y, x, z) volumes reordered to (z, y, x) like matrad cubes"""
+        from scipy.io import loadmat
+        arr = loadmat(filepath, variable_names=[name])[name]
+        if not isinstance(arr, np.ndarray) or arr.dtype.kind not in 'biuf' or arr.ndim not in (3, 4):
+            raise ValueError('"{!s}" in "{!s}" is not a volume'.format(name, filepath))
+        # (y, x, z[, t]) in matlab order
+        return arr.transpose((2,0,1) if arr.ndim == 3 else (3,2,0,1))
+
+    def _loadFromLegacyDoseMat(self, filepath, *args, meta=None, **kwargs):
+        if meta and meta.get('array', None) is not None:
+            return self._loadMatVariable(filepath, meta['array'])
         import sparse2dense.recon
         vol = sparse2dense.recon.reconstruct_from_dosecalc_mat(filepath)
         return vol
 
-    def _loadFromNpy(self, filepath, *args, **kwargs):
-        data = np.load(filepath)
+    def _loadFromNpy(self, filepath, *args, meta=None, **kwargs):
+        # .npy/.npz is told apart by content, so misnamed or extensionless files load too
+        data = np.load(filepath, mmap_mode='r')
         if isinstance(data, np.ndarray):
             return data
+        data.close()
+        if meta and meta.get('array', None) is not None:
+            name = meta['array']
         else:
-            return next(iter(data.values()))
+            # the first array that is a volume
+            arrays = listNpzArrays(filepath)
+            name = next((x[0] for x in arrays if len(x[1]) in (3, 4)), arrays[0][0])
+        vol = NpzVolume(filepath, name)
+        if vol.ndim == 4:
+            return TimeSeriesVolume(vol._getArray())
+        return vol
+
+    def _scanDicomSeries(self, dirpath, progress=None):
+        """read only the headers of the dicom files in dirpath to order slices and compute the affine
 
-    def _loadFromDicom(self, filepath, *args, **kwargs):
+        returns a description of the series (sorted files, shape, dtype, affine) without decoding any pixel data
+        """
         import pydicom
-        import dicom_numpy
-        if os.path.splitext(filepath)[1] not in self.dicom_extensions:
-            if not os.path.isdir(filepath):
-                raise TypeError('file must be a directory containing dicom files or a single dicom file')
-            dcm_datasets = [pydicom.dcmread(os.path.join(filepath, x)) for x in os.listdir(filepath) if os.path.splitext(x)[1] in self.dicom_extensions]
-            vol, affine = dicom_numpy.combine_slices(dcm_datasets)
-            vol = vol.transpose(2,1,0).copy("C")
-            self._cached_affine_matrix = affine
-            return vol
+        fnames = [x for x in os.listdir(dirpath) if os.path.splitext(x)[1] in self.dicom_extensions]
+        headers = []
+        for ii, fname in enumerate(fnames):
+            if progress is not None:
+                progress.update(ii, len(fnames), 'headers')
+            ds = pydicom.dcmread(os.path.join(dirpath, fname), stop_before_pixels=True)
+            if 'ImagePositionPatient' not in ds or 'ImageOrientationPatient' not in ds:
+                continue # not an image slice (e.g. structure set, dicomdir)
+            headers.append((os.path.join(dirpath, fname), ds))
+        if not headers:
+            raise ValueError('no dicom image slices found in "{!s}"'.format(dirpath))
+
+        # keep the largest series in case several share the directory
+        series = {}
+        for f, ds in headers:
+            series.setdefault(getattr(ds, 'SeriesInstanceUID', None), []).append((f, ds))
+        uid, headers = max(series.items(), key=lambda x: len(x[1]))
+
+        ds0 = headers[0][1]
+        orient = np.array(ds0.ImageOrientationPatient, dtype=float)
+        row_cosine, column_cosine = orient[:3], orient[3:]
+        slice_cosine = np.cross(row_cosine, column_cosine)
+        positions = [float(np.dot(slice_cosine, np.array(ds.ImagePositionPatient, dtype=float))) for f, ds in headers]
+        order = np.argsort(positions, kind='stable')
+        headers = [headers[ii] for ii in order]
+        positions = [positions[ii] for ii in order]
+
+        if len(headers) > 1:
+            slice_spacing = float(np.median(np.diff(positions)))
         else:
-            return np.expand_dims(pydicom.dcmread(filepath).pixel_array, axis=0)
-        return None
+            slice_spacing = float(getattr(ds0, 'SpacingBetweenSlices', 0))
+        row_spacing, column_spacing = [float(x) for x in ds0.PixelSpacing]
+        affine = np.identity(4, dtype=np.float32)
+        affine[:3, 0] = row_cosine * column_spacing
+        affine[:3, 1] = column_cosine * row_spacing
+        affine[:3, 2] = slice_cosine * slice_spacing
+        affine[:3, 3] = np.array(headers[0][1].ImagePositionPatient, dtype=float)
 
-    def __fileLoader__(self, filepath, size=None):
-        excepts = []
-        attempts = 0
-        if os.path.isdir(filepath):
-            try:
-                vol = self._loadFromDicom(filepath)
-                if vol is not None:
-                    self._cachedsize = vol.shape[::-1]
-                    return vol
-            except Exception as e:
-                excepts.append(e)
-                self.resetCache()
+        # pixel data is kept in its stored type, rescaling is applied per slice when displayed
+        rescale = any(('RescaleSlope' in ds or 'RescaleIntercept' in ds) for f, ds in headers)
+        dtype = np.dtype('{!s}{:d}'.format('int' if int(ds0.PixelRepresentation) else 'uint', int(ds0.BitsAllocated)))
+        return {'uid': uid,
+                'files': [f for f, ds in headers],
+                'shape': (len(headers), int(ds0.Rows), int(ds0.Columns)),
+                'dtype': dtype.str,
+                'rescale': rescale,
+                'slopes': [float(getattr(ds, 'RescaleSlope', 1)) for f, ds in headers],
+                'intercepts': [float(getattr(ds, 'RescaleIntercept', 0)) for f, ds in headers],
+                'affine': affine,
+                }
 
-        while attempts < len(self.loaders):
-            attempts += 1
+    def _decodeDicomSeries(self, series, progress=None, chunksize=16):
+        """decode stored pixel data of a scanned series across the process pool into one preallocated array"""
+        vol = np.empty(series['shape'], dtype=np.dtype(series['dtype']))
+        files = series['files']
+        chunks = [(ii, files[ii:ii+chunksize]) for ii in range(0, len(files), chunksize)]
+        # small series decode faster in-process than it takes to hand them to the pool
+        if len(chunks) >= 4:
+            futures = {}
             try:
-                loader = self.loaders[attempts-1]
-                if os.path.splitext(filepath)[1].lower() not in loader['valid_exts']:
-                    raise ValueError("file doesn't match valid valid extensions: [{!s}]".format(', '.join(loader['valid_exts'])))
-                vol = loader['callable'](filepath, size)
-                if vol is not None:
-                    self._cachedsize = vol.shape[::-1]
-                    return vol
+                pool = getDecodePool()
+                futures = {pool.submit(_decodeDicomFiles, chunk): ii for ii, chunk in chunks}
+                ndone = 0
+                for future in as_completed(futures):
+                    ii = futures[future]
+                    arr = future.result()
+                    vol[ii:ii+arr.shape[0]] = arr
+                    ndone += arr.shape[0]
+                    if progress is not None:
+                        progress.update(ndone, len(files), 'slices')
+                return vol
+            except LoadCancelled:
+                for future in futures:
+                    future.cancel()
+                raise
             except Exception as e:
-                excepts.append(e)
-                self.resetCache()
+                # fall back to decoding in this process (e.g. if the pool can't be started)
+                shutdownDecodePool()
+                print('parallel dicom decode failed, decoding serially: {!s}'.format(e))
+        for ii, chunk in chunks:
+            if progress is not None:
+                progress.update(ii, len(files), 'slices')
+            vol[ii:ii+len(chunk)] = _decodeDicomFiles(chunk)
+        return vol
+
+    def _loadFromDicom(self, filepath, *args, meta=None, progress=None, **kwargs):
+        import pydicom
+        if os.path.isdir(filepath):
+            index = getDicomIndex() if self.use_dicom_index else None
+            series = index.lookup(filepath) if index is not None else None
+            if series is not None and 'slopes' not in series:
+                # recorded before rescale parameters were indexed, fall back to a full scan. Files added or
+                # removed since the entry was recorded changed the directory's mtime, which lookup() checks
+                series = None
+            if series is None:
+                mtime = os.stat(filepath).st_mtime_ns
+                series = self._scanDicomSeries(filepath, progress=progress)
+                if index is not None:
+                    index.record(filepath, True, series, mtime=mtime)
+            # pixel data is decoded per slice as it is displayed, or in parallel into a (z, y, x) array
+            # once a full decode is needed
+            vol = DicomVolume(series, self._decodeDicomSeries)
+            if meta is not None:
+                meta['affine'] = series['affine']
+            return vol
+        else:
+            return np.expand_dims(pydicom.dcmread(filepath).pixel_array, axis=0)
+        return None
 
-        print("Failed to load image with errors:")
-        for e in excepts:
+    def __fileLoader__(self, filepath, size=None, meta=None, progress=None):
+        if meta is None:
+            meta = {}
+        if progress is None:
+            progress = LoadTask(filepath)
+        perf = getPerfStats()
+        try:
+            with perf.timer('detect', path=filepath):
+                loader = self.detectFormat(filepath, size)
+            if loader is None:
+                raise ValueError('unrecognized file format (extension "{!s}", size {!s})'.format(
+                    os.path.splitext(filepath)[1], tuple(size) if size is not None else None))
+            array = self.selected_arrays.get(filepath, None)
+            if array is not None:
+                meta['array'] = array
+            with perf.timer('load', loader=loader['callable'].__name__, path=filepath):
+                vol = loader['callable'](filepath, size, meta=meta, progress=progress)
+            if vol is not None:
+                meta['size'] = vol.shape[::-1]
+                return vol
+        except LoadCancelled:
+            raise
+        except Exception as e:
+            print("Failed to load image with error:")
             print(e, '\n')
+            meta.clear()
         return None # failed to open
+
+class MaskOverlay:
+    """outlines of many structure masks / label volumes, drawn over the image as a single RGBA layer
+
+    masks are loaded through a data provider. Boundary pixels are computed per slice and orientation the first
+    time they are shown and kept in an LRU, so redrawing a slice with any number of structures only scatters
+    cached edge pixels into one layer. Integer label volumes outline every label, each in its own color.
+
+    With a callback, masks that aren't loaded yet are loaded on the provider's worker threads and left out of
+    the layer until then; callback(filepath) is called from the worker once a mask is ready to be drawn
+    """
+    palette = np.array([(230, 25, 75), (60, 180, 75), (255, 225, 25), (0, 130, 200), (245, 130, 48),
+                        (145, 30, 180), (70, 240, 240), (240, 50, 230), (210, 245, 60), (250, 190, 212),
+                        (0, 128, 128), (220, 190, 255), (170, 110, 40), (255, 250, 200), (128, 0, 0),
+                        (170, 255, 195), (128, 128, 0), (255, 215, 180), (0, 0, 128), (128, 128, 128)], dtype=np.uint8)
+
+    def __init__(self, provider, max_cached_slices=4096, callback=None):
+        self.provider = provider
+        self.max_cached_slices = max_cached_slices
+        self.callback = callback
+        self._structures = OrderedDict()  # path -> palette index
+        self._next_color = 0
+        self._edges = OrderedDict()
+        self._loading = {}  # path -> LoadTask of masks loading in the background
+        self._failed = set()
+        self._lock = threading.Lock()
+
+    def structures(self):
+        return list(self._structures.keys())
+
+    def addStructure(self, filepath):
+        if filepath not in self._structures:
+            # colors stay with a structure while it is toggled on and off
+            self._structures[filepath] = self._next_color
+            self._next_color += 1
+
+    def removeStructure(self, filepath):
+        self._structures.pop(filepath, None)
+        with self._lock:
+            task = self._loading.pop(filepath, None)
+        if task is not None:
+            task.cancel()
+
+    def setStructures(self, filepaths):
+        for filepath in list(self._structures):
+            if filepath not in filepaths:
+                self.removeStructure(filepath)
+        for filepath in filepaths:
+            self.addStructure(filepath)
+
+    def colorOf(self, filepath, label=1):
+        """RGB color a label of a structure is outlined with"""
+        base = self._structures.get(filepath, 0)
+        return tuple(int(x) for x in self.palette[(base+int(label)-1) % len(self.palette)])
+
+    def invalidate(self, filepath=None):
+        """drop cached edges (of filepath, or all), e.g. after the mask changed on disk"""
+        with self._lock:
+            for key in list(self._edges):
+                if filepath is None or key[0] == filepath:
+                    del self._edges[key]
+            if filepath is None:
+                self._failed.clear()
+            else:
+                self._failed.discard(filepath)
+        if filepath is not None:
+            self.provider.resetCache(filepath)
+
+    def getEdges(self, filepath, slicenum, orientation=0, size=None):
+        """(rows, cols, labels) of the boundary pixels of a structure on one slice, or None if unavailable"""
+        key = (filepath, orientation, slicenum, tuple(size) if size is not None else None)
+        with self._lock:
+            edges = self._edges.get(key, None)
+            if edges is not None:
+                self._edges.move_to_end(key)
+                return edges
+            if filepath in self._failed:
+                return None
+        if self.callback is not None and not self.provider.isLoaded(filepath):
+            self._loadAsync(filepath, size)
+            return None
+        data = self.provider.getImageSlice(filepath, slicenum, orientation, size=size)
+        if data is None:
+            return None
+        edges = labelEdges(data)+(data.shape,)
+        with self._lock:
+            self._edges[key] = edges
+            while len(self._edges) > self.max_cached_slices:
+                self._edges.popitem(last=False)
+        return edges
+
+    def _loadAsync(self, filepath, size=None):
+        with self._lock:
+            if filepath in self._loading:
+                return
+            task = self.provider.loadAsync(filepath, size=size)
+            self._loading[filepath] = task
+        task.future.add_done_callback(lambda future: self._loaded(task, future))
+
+    def _loaded(self, task, future):
+        with self._lock:
+            if self._loading.get(task.filepath, None) is task:
+                del self._loading[task.filepath]
+            if task.cancelled:
+                return
+            if future.result() is None:
+                # not retried on every redraw, until invalidated
+                self._failed.add(task.filepath)
+                return
+        if self.callback is not None:
+            self.callback(task.filepath)
+
+    def getLayer(self, slicenum, orientation=0, shape=None, size=None):
+        """RGBA layer of all structures on a slice, or None without any structures
+
+        structures whose slice shape doesn't match shape (the displayed image) are skipped
+        """
+        if not self._structures:
+            return None
+        layer = None
+        for filepath, base in list(self._structures.items()):
+            edges = self.getEdges(filepath, slicenum, orientation, size=size)
+            if edges is None:
+                continue
+            rows, cols, labels, slice_shape = edges
+            if shape is not None and tuple(slice_shape[:2]) != tuple(shape[:2]):
+                continue
+            if layer is None:
+                layer = np.zeros(tuple(slice_shape[:2])+(4,), dtype=np.uint8)
+            colors = (base+labels.astype(np.int64)-1) % len(self.palette)
+            layer[rows, cols, :3] = self.palette[colors]
+            layer[rows, cols, 3] = 255
+        return layer
@@ -0,0 +1,257 @@
+"""fast slice display for the viewer
+
+window/level and the colormap are applied with a lookup table in numpy and the resulting RGBA buffer is shown
+as a QImage, skipping matplotlib's normalization, resampling and Agg rasterization. Matplotlib
+(FigureDefinition_Summary) remains the default backend and is used for export
+"""
+import numpy as np
+from PyQt5 import QtCore, QtGui, QtWidgets
+
+import helpers as pvh
+import render
+
+class LUTCanvas(QtWidgets.QWidget):
+    """widget painting an RGBA image scaled to fit (nearest neighbour), with an optional colorbar strip"""
+    colorbar_width = 18
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setSizePolicy(QtWidgets.QSizePolicy.Expanding, QtWidgets.QSizePolicy.Expanding)
+        self.setAutoFillBackground(True)
+        palette = self.palette()
+        palette.setColor(QtGui.QPalette.Window, QtCore.Qt.white)
+        self.setPalette(palette)
+        self._image = None
+        self._buffer = None  # QImage doesn't own the numpy data it wraps
+        self._aspect = None
+        self._colorbar = None
+        self._colorbar_buffer = None
+        self._clim = None
+
+    @staticmethod
+    def _toQImage(rgba):
+        rgba = np.ascontiguousarray(rgba)
+        h, w = rgba.shape[:2]
+        return QtGui.QImage(rgba.data, w, h, rgba.strides[0], QtGui.QImage.Format_RGBA8888), rgba
+
+    def setImage(self, rgba, aspect=None):
+        self._image, self._buffer = self._toQImage(rgba)
+        self._aspect = aspect
+        self.update()
+
+    def setColorbar(self, lut, clim):
+        if lut is None:
+            self._colorbar = self._colorbar_buffer = self._clim = None
+        else:
+            self._colorbar, self._colorbar_buffer = self._toQImage(lut[::-1, None, :])
+            self._clim = clim
+        self.update()
+
+    def clear(self):
+        self._image = self._buffer = None
+        self.update()
+
+    def _colorbarLabels(self):
+        return ['{:.4g}'.format(self._clim[1]), '{:.4g}'.format(self._clim[0])]
+
+    def _colorbarSpace(self):
+        """width reserved on the right for the colorbar and its labels"""
+        metrics = self.fontMetrics()
+        return max(2*self.colorbar_width, max(metrics.width(x) for x in self._colorbarLabels())) + 8
+
+    def imageRect(self):
+        """area of the widget the image is drawn into"""
+        area = QtCore.QRectF(self.rect())
+        if self._colorbar is not None:
+            area.setWidth(area.width()-self._colorbarSpace())
+        if self._image is None:
+            return area
+        w, h = float(self._image.width()), float(self._image.height())
+        if self._aspect is not None:
+            h *= self._aspect
+        scale = min(area.width()/w, area.height()/h)
+        rect = QtCore.QRectF(0, 0, w*scale, h*scale)
+        rect.moveCenter(area.center())
+        return rect
+
+    def paintEvent(self, event):
+        with pvh.getPerfStats().timer('canvas.paint'):
+            self._paint()
+
+    def _paint(self):
+        painter = QtGui.QPainter(self)
+        painter.setRenderHint(QtGui.QPainter.SmoothPixmapTransform, False)
+        if self._image is not None:
+            painter.drawImage(self.imageRect(), self._image)
+        if self._colorbar is not None:
+            margin = painter.fontMetrics().height()
+            space = self._colorbarSpace()
+            left = self.width()-space
+            bar = QtCore.QRectF(left+(space-self.colorbar_width)/2.0, margin,
+                                self.colorbar_width, max(1, self.height()-2*margin))
+            painter.drawImage(bar, self._colorbar)
+            top, bottom = self._colorbarLabels()
+            painter.drawText(QtCore.QRectF(left, 0, space, margin), QtCore.Qt.AlignCenter, top)
+            painter.drawText(QtCore.QRectF(left, self.height()-margin, space, margin), QtCore.Qt.AlignCenter, bottom)
+        painter.end()
+
+class FigureDefinition_LUT(pvh.baseFigureDefinition):
+    """drop-in replacement for FigureDefinition_Summary drawing through a LUT to a LUTCanvas
+
+    there are no matplotlib axes; the canvas stands in wherever an axes is passed
+    """
+    contour_color = (255, 0, 0, 255)
+
+    def __init__(self):
+        super().__init__()
+        self.ax_ct = None
+        self.colorbar_enabled = False
+        self.autoscale = True
+        self.autoscale_mode = 'slice'
+        self.percentile_clip = (1, 99)
+        self.trueaspect = True
+        self.multires = True
+        self.lut_size = 256
+        self.clim = None
+        self.ctprovider = None
+        self.featureprovider = None
+        self._clim = None
+        self._rgba = None
+        self._aspect = None
+        self._flip = (False, False)
+        self._layer = None
+
+    def Build(self):
+        if self.canvas is None:
+            self.canvas = LUTCanvas()
+        self.ax_ct = self.canvas
+        if self.ctprovider is None:
+            self.ctprovider = pvh.ImageDataProvider()
+            self.featureprovider = pvh.ImageDataProvider()
+        self._initialized = True
+
+    def rebuild(self):
+        if not self.autoscale and self._clim is not None:
+            self.clim = self._clim
+        else:
+            self.clim = None
+        self.Close()
+        self.Build()
+
+    def Close(self):
+        self.clearAxes()
+        if self.canvas is not None:
+            self.canvas.close()
+        self.canvas = None
+        self.ax_ct = None
+
+    def redrawCanvas(self):
+        self._show()
+
+    def clearAxes(self, ax=None):
+        self._rgba = None
+        self._layer = None
+        if self.canvas is not None:
+            self.canvas.clear()
+            self.canvas.setColorbar(None, None)
+
+    def volumeClim(self, stats):
+        return pvh.statsClim(stats, self.autoscale_mode, self.percentile_clip)
+
+    def _selectLevel(self, shape, getlevel):
+        """pyramid level whose resolution still covers the canvas"""
+        if not self.multires or getlevel is None:
+            return 0
+        h, w = shape[:2]
+        ratio = min(w/max(1.0, self.canvas.width()), h/max(1.0, self.canvas.height()))
+        level = 0
+        while 2**(level+1) <= ratio and min(h, w) >> (level+1) >= 1:
+            level += 1
+        return level
+
+    def drawImage(self, ax, data, cmap='gray', flipx=False, flipy=False, aspect_ratio=None, volume_stats=None, getlevel=None,
+                  overlay=None):
+        """window and color data through a lookup table and show it on the canvas, with an optional RGBA overlay
+
+        color limits follow the same autoscale rules as FigureDefinition_Summary.drawImage; with autoscale
+        disabled the previous limits are kept
+        """
+        perf = pvh.getPerfStats()
+        with perf.timer('render', backend='lut'):
+            self._drawImage(data, cmap, flipx, flipy, aspect_ratio, volume_stats, getlevel, overlay)
+        perf.frame()
+
+    def _drawImage(self, data, cmap, flipx, flipy, aspect_ratio, volume_stats, getlevel, overlay):
+        if (not self._initialized):
+            self.Build()
+        clim = None
+        if self.autoscale:
+            clim = self.volumeClim(volume_stats)
+        elif self.clim is not None:
+            clim, self.clim = self.clim, None
+        elif self._clim is not None:
+            clim = self._clim
+        level = self._selectLevel(data.shape, getlevel)
+        if level > 0:
+            data = getlevel(level)
+        if clim is None:
+            clim = render.sliceClim(data)
+        self._clim = clim
+        try:
+            self._rgba = render.renderSlice(data, cmap, clim, flipx=flipx, flipy=flipy, lut_size=self.lut_size)
+        except Exception as e:
+            print(e)
+            return
+        self._flip = (flipx, flipy)
+        self._layer = overlay
+        self._lut = render.getLUT(cmap, self.lut_size)
+        self._aspect = aspect_ratio if self.trueaspect else None
+        self._show()
+
+    def _show(self):
+        if self._rgba is None or self.canvas is None:
+            return
+        rgba = self._rgba
+        layer = self._layer
+        if layer is not None:
+            layer = self._fitLayer(layer, rgba.shape[:2])
+            if layer is not None:
+                rgba = np.where(layer[..., 3:] > 0, layer, rgba)
+        self.canvas.setImage(rgba, self._aspect)
+        self.canvas.setColorbar(self._lut if self.colorbar_enabled else None, self._clim)
+
+    def _fitLayer(self, layer, shape):
+        """orient a full resolution layer like the image and reduce it to a pyramid level's shape"""
+        flipx, flipy = self._flip
+        if flipx:
+            layer = layer[:, ::-1]
+        if flipy:
+            layer = layer[::-1]
+        h, w = shape
+        if layer.shape[:2] == (h, w):
+            return layer
+        f = int(round(layer.shape[0]/float(h)))
+        if f < 2:
+            return None
+        # keep outlines visible at coarser levels: max over each f x f block
+        padded = np.zeros((h*f, w*f, 4), dtype=np.uint8)
+        ph, pw = min(h*f, layer.shape[0]), min(w*f, layer.shape[1])
+        padded[:ph, :pw] = layer[:ph, :pw]
+        return padded.reshape(h, f, w, f, 4).max(axis=(1, 3))
+
+    def clearContour(self, ax):
+        if self._layer is not None:
+            self._layer = None
+            self._show()
+
+    def drawContour(self, ax, maskdata):
+        """outline maskdata > 0 (or each label of an integer label slice) in red"""
+        self.drawOverlay(ax, pvh.edgeLayer(maskdata, color=self.contour_color[:3]))
+
+    def drawOverlay(self, ax, layer):
+        """composite an RGBA layer (e.g. from MaskOverlay.getLayer) over the current slice"""
+        self._layer = layer
+        self._show()
+
+    def sliceCount(self, filepath, orientation=0):
+        return self.ctprovider.getSliceCount(filepath, orientation)
@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+"""headless slice rendering
+
+slices are windowed and colored through vectorized lookup tables and written as PNG images or montages,
+without a display or a matplotlib figure per image. Many volumes are rendered in parallel on a process pool
+"""
+import sys
+import os
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+FILE_DIR = os.path.abspath(os.path.dirname(__file__))
+sys.path.insert(0, FILE_DIR)
+import helpers as pvh
+
+ORIENTATIONS = ['axial', 'coronal', 'sagittal']
+
+_luts = {}
+def getLUT(cmap='gray', n=256):
+    """(n, 4) uint8 RGBA lookup table sampled from a matplotlib colormap"""
+    key = (cmap, n)
+    lut = _luts.get(key, None)
+    if lut is None:
+        import matplotlib
+        if hasattr(matplotlib, 'colormaps'):
+            colormap = matplotlib.colormaps[cmap]
+        else:
+            import matplotlib.cm
+            colormap = matplotlib.cm.get_cmap(cmap)
+        lut = np.round(colormap(np.linspace(0, 1, n))*255).astype(np.uint8)
+        _luts[key] = lut
+    return lut
+
+def windowClim(level, width):
+    """color limits for a window level/width"""
+    return (level-width/2.0, level+width/2.0)
+
+def lutIndices(data, clim, n=256):
+    """map data to lookup table indices for color limits clim (lo, hi); values outside are clipped"""
+    lo, hi = float(clim[0]), float(clim[1])
+    scale = (n-1)/(hi-lo) if hi > lo else 0.0
+    idx = np.subtract(data, lo, dtype=np.float32)
+    idx *= scale
+    np.clip(idx, 0, n-1, out=idx)
+    if data.dtype.kind == 'f':
+        idx[np.isnan(idx)] = 0
+    idx += 0.5
+    return idx.astype(np.uint8 if n <= 256 else np.uint16)
+
+def sliceClim(data):
+    """color limits scaled to the finite values of one slice"""
+    finite = data[np.isfinite(data)] if data.dtype.kind == 'f' else data
+    if finite.size == 0:
+        return (0.0, 1.0)
+    return (float(finite.min()), float(finite.max()))
+
+def resampleAspect(arr, aspect):
+    """nearest-neighbour stretch so that pixels are square, for aspect = pixel height/width"""
+    if aspect is None or not np.isfinite(aspect) or aspect <= 0 or abs(aspect-1.0) < 1e-3:
+        return arr
+    h, w = arr.shape[:2]
+    if aspect > 1:
+        rows = np.minimum((np.arange(int(round(h*aspect)))/aspect).astype(np.intp), h-1)
+        return arr[rows]
+    cols = np.minimum((np.arange(int(round(w/aspect)))*aspect).astype(np.intp), w-1)
+    return arr[:, cols]
+
+def renderSlice(data, cmap='gray', clim=None, flipx=False, flipy=False, aspect=None, max_size=None, lut_size=256):
+    """RGBA (h, w, 4) uint8 image of a 2d slice
+
+    clim defaults to the slice's own range. With max_size the slice is reduced by 2x block averaging until
+    its largest side is below 2*max_size
+    """
+    if max_size:
+        while max(data.shape) >= 2*max_size and min(data.shape) >= 2:
+            data = pvh.downsample2x(data)
+    if clim is None:
+        clim = sliceClim(data)
+    idx = lutIndices(data, clim, lut_size)
+    # gathering whole pixels as uint32 is much faster than indexing (n, 4) rows
+    lut = np.ascontiguousarray(getLUT(cmap, lut_size)).view(np.uint32).reshape(-1)
+    rgba = np.take(lut, idx).view(np.uint8).reshape(idx.shape+(4,))
+    if flipx:
+        rgba = rgba[:, ::-1]
+    if flipy:
+        rgba = rgba[::-1]
+    return resampleAspect(rgba, aspect)
+
+def montage(tiles, ncols=None):
+    """arrange equally sized RGBA tiles in a grid (row-major), padding the last row with transparent tiles"""
+    if ncols is None:
+        ncols = int(np.ceil(np.sqrt(len(tiles))))
+    nrows = int(np.ceil(len(tiles)/ncols))
+    h = max(t.shape[0] for t in tiles)
+    w = max(t.shape[1] for t in tiles)
+    out = np.zeros((nrows*h, ncols*w, 4), dtype=np.uint8)
+    for ii, tile in enumerate(tiles):
+        r, c = divmod(ii, ncols)
+        out[r*h:r*h+tile.shape[0], c*w:c*w+tile.shape[1]] = tile
+    return out
+
+def savePNG(rgba, filepath, compress_level=1):
+    from PIL import Image
+    os.makedirs(os.path.dirname(os.path.abspath(filepath)), exist_ok=True)
+    Image.fromarray(np.ascontiguousarray(rgba), 'RGBA').save(filepath, compress_level=compress_level)
+
+_provider = None
+def _getProvider():
+    """provider reused by every volume rendered in this process"""
+    global _provider
+    if _provider is None:
+        _provider = pvh.ImageDataProvider(cache_bytes=512*1024**2)
+    return _provider
+
+def renderVolume(filepath, outstem, size=None, orientations=(0, 1, 2), slices=None, ntiles=0, cmap='gray',
+                 clim=None, autoscale='percentile', percentile_clip=(1, 99), max_size=None, true_aspect=True,
+                 downcast=None):
+    """write PNG previews of a volume to outstem_<orientation>[_<slice>].png and return their paths
+
+    slices lists the slice indices to render (default: the central slice), or with ntiles > 0 a montage of
+    ntiles evenly spaced slices is written per orientation. Without an explicit clim, the color limits follow
+    the autoscale mode ('slice', 'volume' or 'percentile') as in the viewer. downcast ('float32' or 'float16')
+    reads float volumes at reduced precision
+    """
+    provider = _getProvider()
+    provider.downcast = downcast
+    try:
+        if provider.load(filepath, size) is None:
+            raise ValueError('failed to load "{!s}"'.format(filepath))
+        if clim is None and autoscale != 'slice':
+            clim = pvh.statsClim(provider.getVolumeStats(filepath, size=size), autoscale, percentile_clip)
+        written = []
+        for orientation in orientations:
+            count = provider.getSliceCount(filepath, orientation, size=size)
+            if ntiles:
+                indices = np.unique(np.linspace(0, count-1, min(ntiles, count)).round().astype(int))
+            elif slices:
+                indices = [x for x in slices if 0 <= x < count]
+            else:
+                indices = [count//2]
+            aspect = provider.getAspect(orientation) if true_aspect else None
+            tiles = []
+            for idx in indices:
+                data = provider.getImageSlice(filepath, int(idx), orientation, size=size)
+                # coronal/sagittal are displayed with y flipped, matching the viewer's defaults
+                tiles.append(renderSlice(data, cmap, clim, flipy=(orientation != 0), aspect=aspect, max_size=max_size))
+            if ntiles:
+                outfile = '{!s}_{!s}.png'.format(outstem, ORIENTATIONS[orientation])
+                savePNG(montage(tiles), outfile)
+                written.append(outfile)
+            else:
+                for idx, tile in zip(indices, tiles):
+                    outfile = '{!s}_{!s}_{:d}.png'.format(outstem, ORIENTATIONS[orientation], int(idx))
+                    savePNG(tile, outfile)
+                    written.append(outfile)
+        return written
+    finally:
+        # batch runs touch each volume once, don't hold on to it
+        provider.resetCache(filepath)
+
+def findVolumes(paths, exts, recursive=True):
+    """(filepath, relative output stem) for each volume in paths; directories without dicom slices are scanned"""
+    scanner = pvh.DirectoryScanner(exts, dicom_index=pvh.getDicomIndex())
+    dicom_exts = set(pvh.ImageDataProvider.dicom_extensions)
+    jobs = []
+    for path in paths:
+        path = os.path.abspath(path)
+        if not os.path.isdir(path) or scanner._hasDicom(path):
+            jobs.append((path, os.path.splitext(os.path.basename(path.rstrip('/')))[0]))
+            continue
+        for batch in scanner.scan(path, recursive=recursive):
+            for relpath in batch:
+                # series directories are listed alongside their slices, render the series only
+                if os.path.splitext(relpath)[1].lower() in dicom_exts:
+                    continue
+                stem = os.path.splitext(os.path.normpath(relpath))[0]
+                jobs.append((os.path.normpath(os.path.join(path, relpath)), stem))
+    return jobs
+
+def renderVolumes(jobs, outdir, workers=None, **kwargs):
+    """render (filepath, stem) jobs into outdir on a process pool, returning {filepath: written paths or error}"""
+    results = {}
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = max(1, min(workers, len(jobs)))
+    if workers == 1:
+        for filepath, stem in jobs:
+            try:
+                results[filepath] = renderVolume(filepath, os.path.join(outdir, stem), **kwargs)
+            except Exception as e:
+                results[filepath] = e
+        return results
+    # spawned workers don't inherit the parent's threads (loader pools, sqlite connection)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        futures = {pool.submit(renderVolume, filepath, os.path.join(outdir, stem), **kwargs): filepath
+                   for filepath, stem in jobs}
+        for future in as_completed(futures):
+            try:
+                results[futures[future]] = future.result()
+            except Exception as e:
+                results[futures[future]] = e
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Render slice previews of volumes to PNG without a display')
+    parser.add_argument('paths', nargs='+', help='volume files, dicom series directories or directories to search')
+    parser.add_argument('-o', '--outdir', default='.', help='output directory')
+    parser.add_argument('--size', type=int, nargs=3, metavar=('X', 'Y', 'Z'), help='array size of raw/bin files')
+    parser.add_argument('--orientation', choices=ORIENTATIONS+['all'], default='all')
+    parser.add_argument('--slices', type=int, nargs='+', help='slice indices to render (default: central slice)')
+    parser.add_argument('--montage', type=int, default=0, metavar='N', help='render a montage of N evenly spaced slices')
+    parser.add_argument('--cmap', default='gray')
+    window = parser.add_mutually_exclusive_group()
+    window.add_argument('--clim', type=float, nargs=2, metavar=('MIN', 'MAX'))
+    window.add_argument('--window', type=float, nargs=2, metavar=('LEVEL', 'WIDTH'))
+    parser.add_argument('--autoscale', choices=['slice', 'volume', 'percentile'], default='percentile')
+    parser.add_argument('--percentiles', type=float, nargs=2, default=(1, 99), metavar=('LO', 'HI'))
+    parser.add_argument('--max-size', type=int, help='downsample slices larger than twice this size')
+    parser.add_argument('--no-aspect', action='store_true', help="don't resample to square pixels")
+    parser.add_argument('--no-recursive', action='store_true')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='number of worker processes')
+    parser.add_argument('--downcast', choices=['float32', 'float16'], help='read float volumes at reduced precision')
+    args = parser.parse_args(argv)
+
+    clim = tuple(args.clim) if args.clim else (windowClim(*args.window) if args.window else None)
+    if args.orientation == 'all':
+        orientations = (0, 1, 2)
+    else:
+        orientations = (ORIENTATIONS.index(args.orientation),)
+    jobs = findVolumes(args.paths, _getProvider().getValidExtensions(), recursive=not args.no_recursive)
+    results = renderVolumes(jobs, args.outdir, workers=args.jobs, size=args.size, orientations=orientations,
+                            slices=args.slices, ntiles=args.montage, cmap=args.cmap, clim=clim,
+                            autoscale=args.autoscale, percentile_clip=tuple(args.percentiles),
+                            max_size=args.max_size, true_aspect=not args.no_aspect, downcast=args.downcast)
+    nfailed = 0
+    for filepath, result in sorted(results.items()):
+        if isinstance(result, Exception):
+            nfailed += 1
+            print('{!s}: {!s}'.format(filepath, result))
+        else:
+            for outfile in result:
+                print(outfile)
+    return 1 if nfailed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -13,6 +13,7 @@ setup(name="PyViz",
       packages=['pyviz',],
       entry_points={
           'gui_scripts': ['pyviz = pyviz.gui:start_gui'],
+          'console_scripts': ['pyviz-render = pyviz.render:main'],
       },
       package_data={'pyviz': ['window.ui']},
       install_requires=[
@@ -22,6 +23,5 @@ setup(name="PyViz",
           'pyqt5',
           'numpy',
           'pydicom',
-          'dicom-numpy',
           ],
       )